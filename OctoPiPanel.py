@@ -3,103 +3,114 @@
 __author__ = "Jonas Lorander"
 __license__ = "Simplified BSD 2-Clause License"
 
-import json
+import time
+# When startup began, for --profile-startup
+START_TIME = time.time()
+
+import argparse
 import os
 import platform
-import subprocess
-from collections import deque
-from ConfigParser import RawConfigParser
+import signal
+import sys
 import datetime
 
 import pygame
-import requests
 
-import pygbutton
+import backlight
+import perfstats
+import settings
+
+# Posted by the poller thread when a new printer state is available
+STATE_EVENT = pygame.USEREVENT + 1
+# Timer event used to wake up the idle main loop
+WAKEUP_EVENT = pygame.USEREVENT + 2
+# Posted by the command dispatcher thread when a command is done
+COMMAND_EVENT = pygame.USEREVENT + 3
+# Posted by the file listing thread when a listing has been fetched
+FILES_EVENT = pygame.USEREVENT + 4
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+
+
+def x_running():
+    """True if an X server is running, found without forking pidof."""
+    if os.environ.get('DISPLAY'):
+        return True
+    try:
+        return any(name.startswith('X') for name in os.listdir('/tmp/.X11-unix'))
+    except OSError:
+        return False
+
+
+def use_framebuffer():
+    """Point SDL at the PiTFT and its touchscreen when there's no X server and no driver was chosen."""
+    if platform.system() == 'Linux' and not x_running() and 'SDL_VIDEODRIVER' not in os.environ:
+        # Init framebuffer/touchscreen environment variables
+        os.putenv('SDL_VIDEODRIVER', 'fbcon')
+        os.putenv('SDL_FBDEV', '/dev/fb1')
+        os.putenv('SDL_MOUSEDRV', 'TSLIB')
+        os.putenv('SDL_MOUSEDEV', '/dev/input/touchscreen')
+
+
+class StartupProfile(object):
+    """Time spent in each phase of starting up, printed with --profile-startup."""
+
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = []
+
+    def mark(self, name):
+        """The phase called name just ended."""
+        now = time.time()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        print "Startup phases:"
+        for name, seconds in self.phases:
+            print "  {0:<22}{1:8.1f} ms".format(name, seconds * 1000)
+        print "  {0:<22}{1:8.1f} ms".format("total", (self.last - self.started) * 1000)
 
 
 class OctoPiPanel:
 
-    # Read settings from OctoPiPanel.cfg settings file
-    cfg = RawConfigParser()
-    scriptDirectory = os.path.dirname(os.path.realpath(__file__))
-    settingsFilePath = os.path.join(scriptDirectory, "OctoPiPanel.cfg")
-    cfg.readfp(open(settingsFilePath,"r"))
-
-    api_baseurl = cfg.get('settings', 'baseurl')
-    apikey = cfg.get('settings', 'apikey')
-    updatetime = cfg.getint('settings', 'updatetime')
-
-    if cfg.has_option('settings', 'window_width'):
-        win_width = cfg.getint('settings', 'window_width')
-    else:
-        win_width = 320
-
-    if cfg.has_option('settings', 'window_height'):
-        win_height = cfg.getint('settings', 'window_height')
-    else:
-        win_height = 240
-
-    if cfg.has_option('settings', 'full_screen'):
-        full_screen = cfg.getboolean('settings', 'full_screen')
-    else:
-        full_screen = False
-
-    if cfg.has_option('settings', 'enable_graph'):
-        enable_graph = cfg.getboolean('settings', 'enable_graph')
-    else:
-        enable_graph = True
-
-    if cfg.has_option('settings', 'hotend_temp'):
-        hotend_temp = cfg.getint('settings', 'hotend_temp')
-    else:
-        hotend_temp = 190
-
-    if cfg.has_option('settings', 'hotbed_temp'):
-        hotbed_temp = cfg.getint('settings', 'hotbed_temp')
-    else:
-        hotbed_temp = 50
-
-    if cfg.has_option('settings', 'z_up_value'):
-        z_up_value = cfg.getint('settings', 'z_up_value')
-    else:
-        z_up_value = 25
-
-    addkey = '?apikey={0}'.format(apikey)
-    apiurl_printhead = '{0}/api/printer/printhead'.format(api_baseurl)
-    apiurl_tool = '{0}/api/printer/tool'.format(api_baseurl)
-    apiurl_bed = '{0}/api/printer/bed'.format(api_baseurl)
-    apiurl_command = '{0}/api/printer/command'.format(api_baseurl)
-    apiurl_job = '{0}/api/job'.format(api_baseurl)
-    apiurl_status = '{0}/api/printer?apikey={1}'.format(api_baseurl, apikey)
-    apiurl_connection = '{0}/api/connection'.format(api_baseurl)
-
-    # print apiurl_job + addkey
-
-    graph_area_left   = 30 # 6
-    graph_area_top    = (win_height / 3) * 2
-    graph_area_width  = win_width - graph_area_left - 5
-    graph_area_height = win_height - graph_area_top - 5
-
-    def __init__(self, caption="OctoPiPanel"):
+    def __init__(self, caption="OctoPiPanel", profile_startup=False, settings_path=settings.DEFAULT_PATH, replay=None, replay_speed=1.0):
         """
-        .
+        replay is the path of a recording to show instead of connecting to OctoPrint.
         """
+        self.profile_startup = profile_startup
+        self.startup = StartupProfile(START_TIME)
+        self.startup.mark("imports")
+
+        # Read settings from OctoPiPanel.cfg settings file, reloaded on SIGHUP
+        self.settings = settings.load(settings_path)
+        self.reload_requested = False
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._request_reload)
+        self._api_urls()
+        self.startup.mark("settings")
+
+        # Frame and poll timings, shown by the HUD and written to stats_file on exit
+        self.perf = perfstats.PerfStats()
+        self.show_hud = self.settings.show_hud
+        self.hud_lines = ()
+        self.hud_updated = 0
+        self.render_calls = 0
+
+        self.caption = caption
         self.done = False
+        self.dirty = True
+        self.waited_events = []
         self.color_bg = pygame.Color(41, 61, 70)
 
-        # Button settings
-        self.leftPadding = 5
-        self.buttonSpace = 10 if (self.win_width > 320) else 5
-        self.buttonWidth = (self.win_width - self.leftPadding * 2 - self.buttonSpace * 2) / 3
-        all_buttons_space = self.win_height - 5 if not self.enable_graph else ((self.win_height - 5) / 3) * 2
-        self.buttonHeight = all_buttons_space / 4 - 5
-
         # Status flags
         self.connected = False
         self.hotend_temp = 0.0
         self.bed_temp = 0.0
         self.hotend_temp_target = 0.0
         self.bed_temp_target = 0.0
+        self.heaters = ()
         self.HotHotEnd = False
         self.HotBed = False
         self.Paused = False
@@ -110,386 +121,740 @@ class OctoPiPanel:
         self.PrintTimeLeft = 0
         self.Height = 0.0
         self.FileName = "Nothing"
-        self.getstate_ticks = pygame.time.get_ticks()
-
-        # Lists for temperature data
-        self.HotEndTempList = deque([0] * self.graph_area_width)
-        self.BedTempList = deque([0] * self.graph_area_width)
-
-        if platform.system() == 'Linux':
-            if subprocess.Popen(["pidof", "X"], stdout=subprocess.PIPE).communicate()[0].strip() == "":
-                # Init framebuffer/touchscreen environment variables
-                os.putenv('SDL_VIDEODRIVER', 'fbcon')
-                os.putenv('SDL_FBDEV', '/dev/fb1')
-                os.putenv('SDL_MOUSEDRV', 'TSLIB')
-                os.putenv('SDL_MOUSEDEV', '/dev/input/touchscreen')
-
-        # init pygame and set up screen
-        pygame.init()
+        self.state_seq = 0
+
+        use_framebuffer()
+
+        # Only the display (which brings the event queue) is needed, audio is never used
+        pygame.display.init()
+        # The clock also starts SDL's timer, pygame.time.get_ticks() is 0 without it
+        self.clock = pygame.time.Clock()
+        # Don't queue events nothing looks at, like key releases and window focus changes
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION,
+                                  STATE_EVENT, WAKEUP_EVENT, COMMAND_EVENT, FILES_EVENT])
         pygame.mouse.set_visible(True)
         pygame.mouse.set_cursor((8, 8), (4, 4), (24, 24, 24, 231, 231, 24, 24, 24), (0, 0, 0, 0, 0, 0, 0, 0))
+        self._set_mode()
+        self.startup.mark("display")
+
+        # Show something right away, the rest is loaded while the splash is up
+        self._splash(0.0)
+        self.startup.mark("splash")
+
+        # These pull in requests and pygbutton's font, which take a while to load on a Pi
+        import commandqueue
+        import filebrowser
+        import octoprintapi
+        import pygbutton
+        import statepoller
+        import textcache
+        self._splash(0.3)
+        self.startup.mark("modules")
+
+        # One pooled HTTP session for all API traffic
+        self.api = octoprintapi.OctoPrintAPI(self.settings.baseurl, self.settings.apikey)
+        self.api.on_timing = self._request_timing
+
+        # Printer state is fetched in the background, the main loop only reads snapshots
+        scheduler = statepoller.PollScheduler(self.settings.updatetime, self.settings.idle_updatetime, self.settings.max_idle_updatetime, self.settings.max_error_updatetime)
+        self.poller = statepoller.StatePoller(self.api, self.apiurl_status, self.apiurl_job, self.apiurl_connection, self.settings.updatetime, self._post_state_event, self.settings.slow_updatetime, scheduler)
+
+        # Button commands are sent in the background
+        self.commands = commandqueue.CommandDispatcher(self.api, on_done=self._command_done)
+
+        # So is the file browser's listing, kept for files_updatetime ms
+        self.files = filebrowser.FileListing(self.api, self.apiurl_files, self.settings.files_updatetime / 1000.0, on_done=self._files_done)
+        self.show_files = False
+        self.files_folder = ''
+        self.files_version = None
+
+        # Record every state snapshot, or play back a recording without network access
+        self.replay = None
+        if replay is not None:
+            import staterecorder
+            self.replay = staterecorder.StateReplayer(replay, self.poller, replay_speed, on_done=self._replay_done)
+            self.connected = True
+        elif self.settings.record_file:
+            import staterecorder
+            self.poller.recorder = staterecorder.StateRecorder(os.path.join(SCRIPT_DIRECTORY, self.settings.record_file))
+
+        # Optionally let OctoPrint push state to us, polling is used when the socket is down
+        self.push_client = None
+        if self.settings.push_updates and self.replay is None:
+            import octoprintpush
+            if octoprintpush.websocket is None:
+                print "push_updates needs the websocket-client module, polling instead"
+            else:
+                self.push_client = octoprintpush.PushClient(self.api, self.poller, throttle=max(1, self.settings.updatetime / 500))
+                self.push_client.on_files_changed = self._files_changed
+
+        # The screen is turned off after backlightofftime ms without a touch
+        self.backlight = backlight.Backlight(self.settings.backlight_path)
+        self.idle = backlight.IdleManager(self.backlight, self.settings.backlightofftime)
+        self.swallow_tap = False
+
+        self.startup.mark("api, threads")
+
+        # Rendered texts are reused until the text changes
+        self.text_cache = textcache.TextCache()
+        self.fonts = {}
+
+        # What a tap on each button does, only Connect, Exit and browsing files already listed work while disconnected
+        self.actions = {
+            'btnHomeXY': (self._home_xy, False),
+            'btnHomeZ': (self._home_z, False),
+            'btnZUp': (self._z_up, False),
+            'btnHeatBed': (self._heat_bed, False),
+            'btnHeatHotEnd': (self._heat_hotend, False),
+            'btnStartPrint': (self._start_print, False),
+            'btnAbortPrint': (self._abort_print, False),
+            'btnPausePrint': (self._pause_print, False),
+            'btnReboot': (self._reboot, False),
+            'btnFan': (self._fan, False),
+            'btnConnect': (self._connect, True),
+            'btnExit': (self._exit, True),
+            'btnFiles': (self._show_files, False),
+            'btnFilesPageUp': (self._files_page_up, True),
+            'btnFilesPageDown': (self._files_page_down, True),
+            'btnFilesBack': (self._hide_files, True),
+        }
+
+        # Screens, buttons and where they go are read from layout.json
+        self.screen_layout = self._load_layout()
+
+        # Fonts, button positions and the graph follow from the settings
+        self.graph = None
+        self._layout()
+        self._splash(1.0)
+        self.startup.mark("fonts, layout")
+
+        # Init of class done
+        print "OctoPiPanel initiated"
 
-        if self.full_screen:
-            modes = pygame.display.list_modes()
+    def _load_layout(self):
+        """The ScreenLayout in layout_file, raises SettingsError if it has a button the panel has no action for."""
+        import screenlayout
+        layout = screenlayout.ScreenLayout(os.path.join(SCRIPT_DIRECTORY, self.settings.layout_file))
+        for screen in layout.screens:
+            for name, caption, color in layout.buttons(screen, self.settings.as_dict()):
+                if name not in self.actions:
+                    raise settings.SettingsError("{0} in {1} has no action".format(name, layout.path))
+        return layout
+
+    def _api_urls(self):
+        self.apiurl_printhead = self.settings.url('/api/printer/printhead')
+        self.apiurl_tool = self.settings.url('/api/printer/tool')
+        self.apiurl_bed = self.settings.url('/api/printer/bed')
+        self.apiurl_command = self.settings.url('/api/printer/command')
+        self.apiurl_job = self.settings.url('/api/job')
+        self.apiurl_status = self.settings.url('/api/printer')
+        self.apiurl_connection = self.settings.url('/api/connection')
+        self.apiurl_files = self.settings.url('/api/files?recursive=true')
+
+    def _set_mode(self):
+        if self.settings.full_screen:
             self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
         else:
-            self.screen = pygame.display.set_mode( (self.win_width, self.win_height) )
-        pygame.display.set_caption( caption )
-
-        # Set font
-        font_size = 14 if self.enable_graph else 16
-        self.fntText = pygame.font.Font(os.path.join(self.scriptDirectory, "DejaVuSans.ttf"), font_size)
-        self.fntText.set_bold(True)
-        self.fntTextSmall = pygame.font.Font(os.path.join(self.scriptDirectory, "DejaVuSans.ttf"), 10)
-        self.fntTextSmall.set_bold(True)
-
-        # Home X/Y, start/abort print & reboot buttons
-        btn_gap = 5
-        first_column = self.leftPadding
-        second_column = self.leftPadding + self.buttonWidth + self.buttonSpace
-        third_column = self.leftPadding + self.buttonWidth * 2 + self.buttonSpace * 2
-
-        first_row = btn_gap
-        self.btnHomeXY        = pygbutton.PygButton((first_column, btn_gap, self.buttonWidth, self.buttonHeight), "Home X/Y")
-        self.btnStartPrint    = pygbutton.PygButton((second_column, btn_gap, self.buttonWidth, self.buttonHeight), "Start print")
-        self.btnAbortPrint    = pygbutton.PygButton((second_column, btn_gap, self.buttonWidth, self.buttonHeight), "Abort print", (200, 0, 0))
-        self.btnConnect        = pygbutton.PygButton((third_column, btn_gap, self.buttonWidth, self.buttonHeight), "Connect")
-
-        # Home Z, Z up/pause & Shutdown buttons
-        btn_gap += 5
-        second_row = self.buttonHeight + btn_gap
-        self.btnHomeZ         = pygbutton.PygButton((first_column, second_row, self.buttonWidth, self.buttonHeight), "Home Z")
-        self.btnZUp           = pygbutton.PygButton((second_column, second_row, self.buttonWidth, self.buttonHeight), "Z +" + str(self.z_up_value))
-        self.btnPausePrint    = pygbutton.PygButton((second_column,  second_row, self.buttonWidth, self.buttonHeight), "Pause print")
-        self.btnReboot      = pygbutton.PygButton((third_column, second_row, self.buttonWidth, self.buttonHeight), "Reboot");
-
-        # Heat buttons
-        btn_gap += 5
-        third_row = self.buttonHeight * 2 + btn_gap
-        self.btnHeatBed       = pygbutton.PygButton((first_column, third_row, self.buttonWidth, self.buttonHeight), "Heat bed")
-        self.btnFan           = pygbutton.PygButton((third_column, third_row, self.buttonWidth, self.buttonHeight), "Turn fan on")
-
-        btn_gap += 5
-        fourth_row = self.buttonHeight * 3 + btn_gap
-        self.btnHeatHotEnd    = pygbutton.PygButton((first_column, fourth_row, self.buttonWidth, self.buttonHeight), "Heat hot end")
-        self.btnExit          = pygbutton.PygButton((third_column, fourth_row, self.buttonWidth, self.buttonHeight), "Exit")
+            self.screen = pygame.display.set_mode( (self.settings.window_width, self.settings.window_height) )
+        pygame.display.set_caption( self.caption )
+
+    def _font(self, size):
+        """DejaVuSans bold in size points, loaded once."""
+        font = self.fonts.get(size)
+        if font is None:
+            font = self.fonts[size] = pygame.font.Font(os.path.join(SCRIPT_DIRECTORY, "DejaVuSans.ttf"), size)
+            font.set_bold(True)
+        return font
+
+    def _layout(self):
+        """Size and place fonts, buttons, the graph and the file list for the current screen and window size."""
+        import filebrowser
+        import hittest
+        import pygbutton
+
+        if self.show_files:
+            self.screen_name = 'files'
+        else:
+            self.screen_name = 'main_graph' if self.settings.enable_graph else 'main'
+        geometry = self.screen_layout.geometry(self.screen_name, self.settings.window_width, self.settings.window_height)
+
+        # Set font, the small one is only used by the graph
+        self.fntText = self._font(geometry.font_size)
+        if geometry.small_font_size:
+            self.fntTextSmall = self._font(geometry.small_font_size)
+
+        # Buttons in drawing order, each created the first time a screen has it
+        self.buttons = []
+        self.registry = hittest.WidgetRegistry()
+        for name, caption, color in self.screen_layout.buttons(self.screen_name, self.settings.as_dict()):
+            btn = getattr(self, name, None)
+            if btn is None:
+                btn = pygbutton.PygButton(None, caption, color or pygbutton.LIGHTGRAY)
+                setattr(self, name, btn)
+            btn.rect = geometry.buttons[name]
+            self.buttons.append((name, btn))
+            action, always = self.actions[name]
+            self.registry.add(name, btn, action, always)
+        self.text_positions = geometry.text_positions
+
+        # Temperature graph, its static parts are pre-rendered. It keeps
+        #  collecting samples on screens that don't show it.
+        if not self.settings.enable_graph:
+            self.graph = None
+        self.graph_rect = None
+        if geometry.graph is not None:
+            g = geometry.graph
+            if self.graph is None:
+                import tempgraph
+                self.graph = tempgraph.TempGraph(g.left, g.top, g.width, g.height, self.fntTextSmall, self.color_bg)
+            elif (g.left, g.top, g.width, g.height) != (self.graph.left, self.graph.top, self.graph.width, self.graph.height):
+                self.graph.resize(g.left, g.top, g.width, g.height)
+            self.graph_rect = self.graph.rect.clip(self.screen.get_rect())
+            # Tapping the graph steps through its zoom levels, connected or not
+            self.registry.add('graph', self.graph, self._zoom_graph, always=True)
+
+        # Rows of the folder shown by the file browser
+        self.file_list = None
+        if geometry.file_list is not None:
+            small_font = self.fntTextSmall if geometry.small_font_size else self.fntText
+            self.file_list = filebrowser.FileList(geometry.file_list, self.fntText, small_font, self.color_bg)
+            self._show_folder(self.files_folder)
+
+        # Widgets are only redrawn when they change, see draw()
+        self.rules_changed = True
+        self.drawn = {}
+        self.full_redraw = True
+        self.dirty = True
+
+    def _request_reload(self, signum, frame):
+        # Signal handler, the settings are reloaded by the main loop
+        self.reload_requested = True
+
+    def _reload_settings(self):
+        """Apply changes to OctoPiPanel.cfg to the running panel."""
+        self.reload_requested = False
+        try:
+            new = settings.load(self.settings.path)
+        except settings.SettingsError as e:
+            print "Settings not reloaded: {0}".format(e)
+            return
 
-        # Init of class done
-        print "OctoPiPanel initiated"
+        changed = new.changed(self.settings)
+        if not changed:
+            print "Settings unchanged"
+            return
+        print "Settings reloaded, changed: {0}".format(", ".join(sorted(changed)))
+        self.settings = new
+
+        if changed & set(['baseurl', 'apikey']):
+            self.api.configure(new.baseurl, new.apikey)
+            self._api_urls()
+        self.files.configure(self.apiurl_files, new.files_updatetime / 1000.0)
+        self.poller.configure(self.apiurl_status, self.apiurl_job, self.apiurl_connection, new.updatetime, new.slow_updatetime)
+        self.poller.scheduler.configure(new.updatetime, new.idle_updatetime, new.max_idle_updatetime, new.max_error_updatetime)
+        self.poller.poke()
+
+        self.backlight.path = new.backlight_path
+        self.idle.timeout = new.backlightofftime
+        self.show_hud = new.show_hud
+        for name in ('push_updates', 'record_file'):
+            if name in changed:
+                print "{0} takes effect after a restart".format(name)
+        if 'layout_file' in changed:
+            try:
+                self.screen_layout = self._load_layout()
+            except settings.SettingsError as e:
+                print "Layout not reloaded: {0}".format(e)
+
+        if changed & set(['window_width', 'window_height', 'full_screen']):
+            self._set_mode()
+        self._layout()
    
     def Start(self):
         # OctoPiPanel started
         print "OctoPiPanel started!"
         print "---"
-        
+
+        if self.replay is not None:
+            print "Replaying {0} at {1}x".format(self.replay.path, self.replay.speed)
+            self.replay.start()
+        self.poller.start()
+        self.commands.start()
+        self.files.start()
+        if self.push_client is not None:
+            self.push_client.start()
+        clock = self.clock
+
         """ game loop: input, move, render"""
         while not self.done:
+            frame_started = time.time()
+
+            # Apply an edited OctoPiPanel.cfg after SIGHUP
+            if self.reload_requested:
+                self._reload_settings()
+
             # Handle events
             self.handle_events()
 
-            # Update info from printer every other seconds
-            if pygame.time.get_ticks() - self.getstate_ticks > self.updatetime:
-                self.get_state()
-                self.getstate_ticks = pygame.time.get_ticks()
+            # Pick up the latest info from the printer, never blocks
+            self.get_state()
+            self.get_files()
+
+            # Undo what failed commands changed, and show or clear what failed last
+            failure = self.commands.last_failure
+            if self.commands.process_results() or self.commands.last_failure != failure:
+                self.dirty = True
 
             # Update buttons visibility, text, graphs etc
             self.update()
 
-            # Draw everything
-            self.draw()
-            
+            # Turn the screen off when nobody has touched it for a while
+            if self.idle.check(pygame.time.get_ticks()):
+                self.poller.scheduler.screen_off = True
+                # Without a backlight to switch, black is the closest to off
+                if self.backlight.path is None:
+                    self.screen.fill((0, 0, 0))
+                    pygame.display.flip()
+
+            # Refresh the timings overlay once a second
+            if self.show_hud:
+                self._update_hud()
+
+            # Draw everything, nothing is drawn while the screen is off
+            if self.dirty and self.idle.screen_on:
+                self.render_calls = 0
+                self.draw()
+                self.perf.add('render_calls', self.render_calls)
+                self.perf.add('frame', (time.time() - frame_started) * 1000.0)
+                if self.startup is not None:
+                    self.startup.mark("first frame")
+                    if self.profile_startup:
+                        self.startup.report()
+                        self.done = True
+                    self.startup = None
+            self.dirty = False
+
+            # Cap the frame rate, and sleep until something happens if nothing changed
+            clock.tick(self.settings.max_fps)
+            if not self.done and not pygame.event.peek():
+                timeout = self.settings.updatetime
+                if self.show_hud:
+                    timeout = min(timeout, 1000)
+                until_off = self.idle.time_until_off(pygame.time.get_ticks())
+                if until_off is not None:
+                    timeout = max(1, min(timeout, until_off))
+                self._wait_for_event(timeout)
+
         # OctoPiPanel is going down.
         print "OctoPiPanel is going down."
+        if self.replay is not None:
+            self.replay.stop()
+            print "Replay: {0} snapshots shown".format(self.replay.snapshots)
+        if self.poller.recorder is not None:
+            self.poller.recorder.close()
+            print "Recorded {0} snapshots to {1}".format(self.poller.recorder.snapshots, self.poller.recorder.path)
+        self.poller.stop()
+        self.commands.stop()
+        self.files.stop()
+        if self.push_client is not None:
+            self.push_client.stop()
+        for thread in (self.poller, self.commands, self.files, self.replay):
+            if thread is not None and thread.is_alive():
+                thread.join(1)
+        print "API: {requests} requests, {failures} failed, {not_modified} not modified, {unchanged} unchanged, {connections} connections opened, {reused} reused".format(**self.api.stats())
+        self.api.close()
+        print "Commands: {0} sent, {1} merged, {2} failed".format(self.commands.sent, self.commands.merged, self.commands.failed)
+        print "Text cache: {hits} hits, {misses} misses, {evictions} evictions ({hit_rate:.0%} hit rate)".format(**self.text_cache.stats())
+        self._dump_stats()
+
+        # Don't leave a dark screen behind
+        self.backlight.set(True)
 
         """ Quit """
         pygame.quit()
        
+    def _replay_done(self):
+        # Called from the replay thread, quitting writes the timings of the whole replay
+        print "Replay finished"
+        if pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+    def _request_timing(self, method, path, ms):
+        # Called by the API client from whichever thread made the request
+        self.perf.add('{0} {1}'.format(method, path), ms)
+
+    def _update_hud(self):
+        now = pygame.time.get_ticks()
+        if self.hud_lines and now - self.hud_updated < 1000:
+            return
+        self.hud_updated = now
+
+        names = ['frame', 'handle_events', 'get_state', 'update', 'draw', 'send_command']
+        names += [name for name in self.perf.names() if name.startswith(('GET ', 'POST '))]
+        # render_calls is a count, not a time
+        lines = tuple(["p50/p95/max ms"] + self.perf.lines(names) + ["p50/p95/max per frame"] + self.perf.lines(['render_calls']))
+        if lines != self.hud_lines:
+            self.hud_lines = lines
+            self.dirty = True
+
+    def _hud_labels(self):
+        """The timings overlay as (text surface, position), in the top left corner."""
+        font = self._font(10)
+        labels = []
+        y = 2
+        for line in self.hud_lines:
+            lbl = self.text_cache.render(font, line, (255, 255, 0))
+            labels.append((lbl, (2, y)))
+            y += lbl.get_height()
+        return labels
+
+    def _hud_rect(self):
+        labels = self._hud_labels()
+        width = max([lbl.get_width() for lbl, pos in labels] or [0])
+        return pygame.Rect(0, 0, width + 4, sum(lbl.get_height() for lbl, pos in labels) + 4)
+
+    def _dump_stats(self):
+        """Write the timings and what they were measured on to stats_file."""
+        if not self.settings.stats_file:
+            return
+        path = os.path.join(SCRIPT_DIRECTORY, self.settings.stats_file)
+        info = self.settings.as_dict()
+        del info['apikey']
+        info = {
+            'settings': info,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'api': self.api.stats(),
+        }
+        try:
+            self.perf.dump(path, info)
+            print "Timings written to {0}".format(path)
+        except IOError as e:
+            print "Could not write timings: {0}".format(e)
+
+    def _splash(self, progress):
+        """Startup screen, a bar showing how far loading has come."""
+        w, h = self.screen.get_size()
+        bar = pygame.Rect(w / 4, h / 2 - 3, w / 2, 6)
+        if progress == 0.0:
+            self.screen.fill(self.color_bg)
+            pygame.draw.rect(self.screen, (200, 200, 200), bar, 1)
+            pygame.display.flip()
+        else:
+            pygame.draw.rect(self.screen, (200, 200, 200), (bar.left, bar.top, int(bar.width * progress), bar.height))
+            pygame.display.update(bar)
+
+    def _wait_for_event(self, timeout):
+        """Block until an event arrives or timeout ms has passed."""
+        pygame.time.set_timer(WAKEUP_EVENT, timeout)
+        event = pygame.event.wait()
+        pygame.time.set_timer(WAKEUP_EVENT, 0)
+
+        if event.type != WAKEUP_EVENT:
+            self.waited_events.append(event)
+
+    def _post_state_event(self):
+        # Called from the poller thread, SDL's event queue is thread safe
+        if pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(STATE_EVENT))
+
+    def _command_done(self):
+        # Called from the dispatcher thread, show the result of the command soon
+        self.poller.poke()
+        if pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(COMMAND_EVENT))
+
+    def _files_done(self):
+        # Called from the file listing thread
+        if pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(FILES_EVENT))
+
+    def _files_changed(self):
+        # Called from the push client thread, an open file browser fetches the new listing right away
+        self.files.invalidate()
+        if pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(FILES_EVENT))
+
+    def _wake_screen(self, now):
+        """Turn the screen back on, with fresh printer state."""
+        self.idle.wake(now)
+        self.poller.scheduler.screen_off = False
+        self.poller.poke()
+        self.full_redraw = True
+        self.dirty = True
+
+    @perfstats.timed('handle_events')
     def handle_events(self):
         """handle all events."""
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                print "Quit"
-                self.done = True
-
-            # It should only be possible to click a button if you can see it
-            #  e.g. the backlight is on
-            if self.connected:
-                if 'click' in self.btnHomeXY.handleEvent(event):
-                    self._home_xy()
-
-                if 'click' in self.btnHomeZ.handleEvent(event):
-                    self._home_z()
-
-                if 'click' in self.btnZUp.handleEvent(event):
-                    self._z_up()
-
-                if 'click' in self.btnHeatBed.handleEvent(event):
-                    self._heat_bed()
+        events = self.waited_events + pygame.event.get()
+        self.waited_events = []
 
-                if 'click' in self.btnHeatHotEnd.handleEvent(event):
-                    self._heat_hotend()
+        # Buttons shown or hidden since the last frame
+        self.registry.refresh()
 
-                if 'click' in self.btnStartPrint.handleEvent(event):
-                    self._start_print()
+        for event in events:
+            if event.type in (STATE_EVENT, WAKEUP_EVENT, COMMAND_EVENT, FILES_EVENT):
+                continue
 
-                if 'click' in self.btnAbortPrint.handleEvent(event):
-                    self._abort_print()
+            # Touchscreens send motion in floods, it only counts as activity
+            #  and for dragging the file list
+            if event.type == pygame.MOUSEMOTION:
+                if self.idle.screen_on:
+                    self.idle.activity(pygame.time.get_ticks())
+                    if self.file_list is not None and self.file_list.dragging:
+                        self.file_list.handle(event)
+                        self.dirty = True
+                continue
 
-                if 'click' in self.btnPausePrint.handleEvent(event):
-                    self._pause_print()
+            # Any other input may change what is on screen
+            self.dirty = True
 
-                if 'click' in self.btnReboot.handleEvent(event):
-                    self._reboot()
+            if event.type == pygame.QUIT:
+                print "Quit"
+                self.done = True
 
-                if 'click' in self.btnFan.handleEvent(event):
-                    self._fan()
+            # Show or hide the timings overlay
+            if event.type == pygame.KEYDOWN and event.key in (pygame.K_h, pygame.K_F1):
+                self.show_hud = not self.show_hud
+                self.hud_lines = ()
+                self.full_redraw = True
 
-            if 'click' in self.btnConnect.handleEvent(event):
-                self._connect()
-            
-            if 'click' in self.btnExit.handleEvent(event):
-                self._exit()
+            # It should only be possible to click a button if you can see it
+            #  e.g. the backlight is on
+            if event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+                now = pygame.time.get_ticks()
+                if not self.idle.screen_on:
+                    # The tap that wakes the screen doesn't press anything
+                    if event.type == pygame.MOUSEBUTTONDOWN:
+                        self._wake_screen(now)
+                        self.swallow_tap = True
+                    continue
+                if self.swallow_tap:
+                    if event.type == pygame.MOUSEBUTTONUP:
+                        self.swallow_tap = False
+                    continue
+                self.idle.activity(now)
+
+                if self.file_list is not None:
+                    index = self.file_list.handle(event)
+                    if index is not None:
+                        self._file_tapped(self.file_list.entries[index])
+                self.registry.dispatch(event, self.connected)
 
     """
-    Get status update from API, regarding temp etc.
+    Get status update from the background poller, regarding temp etc.
     """
+    @perfstats.timed('get_state')
     def get_state(self):
-        if self.connected:
-            try:
-                req = requests.get(self.apiurl_status)
-
-                if req.status_code == 200:
-                    state = json.loads(req.text)
-
-                    # Set status flags
-                    temp_key = 'temps' if 'temps' in state else 'temperature'
-                    self.hotend_temp = state[temp_key]['tool0']['actual']
-                    self.bed_temp = state[temp_key]['bed']['actual']
-                    self.hotend_temp_target = state[temp_key]['tool0']['target']
-                    self.bed_temp_target = state[temp_key]['bed']['target']
-
-                    if self.hotend_temp_target is None:
-                        self.hotend_temp_target = 0.0
-
-                    if self.bed_temp_target is None:
-                        self.bed_temp_target = 0.0
-
-                    if self.hotend_temp_target > 0.0:
-                        self.HotHotEnd = True
-                    else:
-                        self.HotHotEnd = False
-
-                    if self.bed_temp_target > 0.0:
-                        self.HotBed = True
-                    else:
-                        self.HotBed = False
-
-                        # print self.apiurl_status
-                elif req.status_code == 401:
-                    print "Error: {0}".format(req.text)
+        state = self.poller.state
+        if state.seq == self.state_seq:
+            return
+        self.state_seq = state.seq
+        self.dirty = True
+        self.rules_changed = True
+        if self.replay is not None:
+            self.replay.ack(state.seq)
+        was_printing = self.Printing
+
+        # Set status flags
+        self.hotend_temp = state.hotend_temp
+        self.bed_temp = state.bed_temp
+        self.hotend_temp_target = state.hotend_temp_target
+        self.bed_temp_target = state.bed_temp_target
+        self.heaters = state.heaters
+        self.HotHotEnd = state.HotHotEnd
+        self.HotBed = state.HotBed
+
+        self.Completion = state.Completion  # In procent
+        self.PrintTimeLeft = state.PrintTimeLeft
+        self.FileName = state.FileName
+        self.JobLoaded = state.JobLoaded
+        self.Paused = state.Paused
+        self.Printing = state.Printing
+
+        # Save temperatures to the graph, its job history starts over with every print
+        if self.graph is not None:
+            if self.Printing and not was_printing:
+                self.graph.start_job()
+            self.graph.add_sample(self.heaters, state.timestamp)
 
-                # Get info about current job
-                req = requests.get(self.apiurl_job + self.addkey)
-                job_state = None
-                if req.status_code == 200:
-                    job_state = json.loads(req.text)
+    """
+    Show a new file listing from the background thread, if the file browser is up.
+    """
+    def get_files(self):
+        if self.file_list is None:
+            return
+        # Keep the open browser up to date, returns right away while the listing is fresh
+        self.files.request()
+        if self.files.version == self.files_version:
+            return
+        self._show_folder(self.files_folder)
+        self.dirty = True
+
+    def _show_folder(self, folder, top=False):
+        """Show the entries of folder in the file list, the top folder if it's gone."""
+        self.files_version = self.files.version
+        entries = self.files.entries(folder)
+        if entries is None:
+            folder, entries, top = '', self.files.entries('') or [], True
+        self.files_folder = folder
+
+        if self.files.error is not None:
+            message = self.files.error
+        elif self.files.fetched is None:
+            message = "Loading..."
+        else:
+            message = "No files"
+        self.file_list.show(entries, message, top)
 
-                req = requests.get(self.apiurl_connection + self.addkey)
-                if req.status_code == 200:
-                    conn_state = json.loads(req.text)
+    """
+    Update buttons, text, graphs etc.
+    """
+    @perfstats.timed('update')
+    def update(self):
+        # Buttons are shown, hidden and captioned by the rules in the layout,
+        #  only worked out again when something the rules look at has changed
+        if not self.rules_changed:
+            return
+        self.rules_changed = False
+        self.screen_layout.apply(self.screen_name, dict(self.buttons), self._conditions(), self.settings.as_dict())
+
+    def _conditions(self):
+        """Values of the conditions used by the rules in the layout, see screenlayout.CONDITIONS."""
+        busy = self.Printing or self.Paused
+        return {
+            'idle': not busy,
+            'busy': busy,
+            'paused': self.Paused,
+            'job_loaded': self.JobLoaded,
+            'hot_hotend': self.HotHotEnd,
+            'hot_bed': self.HotBed,
+            'fan_spinning': self.FanSpinning,
+            'connected': self.connected,
+        }
+
+    @perfstats.timed('draw')
+    def draw(self):
+        """Redraw the parts of the screen that have changed since the last frame."""
+        dirty_rects = []
+        for name, key, rect in self._widgets():
+            drawn = self.drawn.get(name)
+            if drawn is None or drawn[0] != key:
+                if drawn is not None:
+                    dirty_rects.append(drawn[1])
+                dirty_rects.append(rect)
+            self.drawn[name] = (key, rect)
+
+        if self.full_redraw:
+            dirty_rects = [self.screen.get_rect()]
+            self.full_redraw = False
+
+        if not dirty_rects:
+            return
 
-                    # print self.apiurl_job + self.addkey
+        # Paint everything touching the changed area once, then push only the changed rects
+        area = dirty_rects[0].unionall(dirty_rects[1:])
+        self.screen.set_clip(area)
+        self._paint(area)
+        self.screen.set_clip(None)
 
-                    self.Completion = job_state['progress']['completion']  # In procent
-                    self.PrintTimeLeft = job_state['progress']['printTimeLeft']
-                    # self.Height = state['currentZ']
-                    self.FileName = job_state['job']['file']['name']
-                    self.JobLoaded = conn_state['current']['state'] == "Operational" and (job_state['job']['file']['name'] != "") or (job_state['job']['file']['name'] is not None)
+        # update screen
+        pygame.display.update(dirty_rects)
 
-                    # Save temperatures to lists
-                    if self.enable_graph:
-                        self.HotEndTempList.popleft()
-                        self.HotEndTempList.append(self.hotend_temp)
-                        self.BedTempList.popleft()
-                        self.BedTempList.append(self.bed_temp)
+    def _widgets(self):
+        """
+        Every widget on screen as (name, key, rect). A widget is redrawn
+        when its key differs from the one it was last drawn with.
+        """
+        widgets = []
+        for name, btn in self.buttons:
+            widgets.append((name, (btn.visible, btn.caption), btn.rect))
 
-                    self.Paused = conn_state['current']['state'] == "Paused"
-                    self.Printing = conn_state['current']['state'] == "Printing"
+        for i, (font, text, color, pos) in enumerate(self._labels()):
+            widgets.append(('label%d' % i, (text, color), pygame.Rect(pos, self.text_cache.render(font, text, color).get_size())))
 
-            except requests.exceptions.ConnectionError as e:
-                print "Connection Error ({0}): {1}".format(e.errno, e.strerror)
+        if self.graph_rect is not None:
+            widgets.append(('graph', (self.state_seq, self.graph.zoom), self.graph_rect))
 
-            return
-        else:
-            print "Not connected!"
+        if self.file_list is not None:
+            widgets.append(('file_list', self.file_list.key(self._loaded_file()), self.file_list.rect))
 
-    """
-    Update buttons, text, graphs etc.
-    """
-    def update(self):
-        # Set home buttons visibility
-        self.btnHomeXY.visible = not (self.Printing or self.Paused)
-        self.btnHomeZ.visible = not (self.Printing or self.Paused)
-        self.btnZUp.visible = not (self.Printing or self.Paused)
-
-        # Set abort and pause buttons visibility
-        self.btnStartPrint.visible = not (self.Printing or self.Paused) and self.JobLoaded
-        self.btnAbortPrint.visible = self.Printing or self.Paused
-        self.btnPausePrint.visible = self.Printing or self.Paused
-
-        # Set texts on pause button
-        if self.Paused:
-            self.btnPausePrint.caption = "Resume"
-        else:
-            self.btnPausePrint.caption = "Pause"
-        
-        # Set abort, pause, reboot and shutdown buttons visibility
-        self.btnHeatHotEnd.visible = not (self.Printing or self.Paused)
-        self.btnHeatBed.visible = not (self.Printing or self.Paused)
-        self.btnConnect.visible = not (self.Printing or self.Paused)
-        self.btnReboot.visible = not (self.Printing or self.Paused)
-        self.btnFan.visible = not (self.Printing or self.Paused)
-
-        # Set texts on heat buttons
-        if self.HotHotEnd:
-            self.btnHeatHotEnd.caption = "Turn off hot end"
-        else:
-            self.btnHeatHotEnd.caption = "Heat hot end"
-        
-        if self.HotBed:
-            self.btnHeatBed.caption = "Turn off bed"
-        else:
-            self.btnHeatBed.caption = "Heat bed"
+        # Always listed, so the strip is painted over when the failure clears
+        widgets.append(('command_status', self.commands.last_failure, self._command_status_rect()))
 
-        if self.FanSpinning:
-            self.btnFan.caption = "Turn fan off"
-        else:
-            self.btnFan.caption = "Turn fan on"
+        if self.show_hud:
+            widgets.append(('hud', self.hud_lines, self._hud_rect()))
 
-        if self.connected:
-            self.btnConnect.caption = "Disconnect"
-        else:
-            self.btnConnect.caption = "Connect"
+        return widgets
 
-        return
-               
-    def draw(self):
-        # clear whole screen
-        self.screen.fill( self.color_bg )
+    def _command_status_rect(self):
+        """Strip along the bottom of the screen where the last failed command is shown."""
+        screen_rect = self.screen.get_rect()
+        height = self.fntText.get_linesize() + 4
+        return pygame.Rect(0, screen_rect.bottom - height, screen_rect.width, height)
 
-        # Draw buttons
-        self.btnHomeXY.draw(self.screen)
-        self.btnHomeZ.draw(self.screen)
-        self.btnZUp.draw(self.screen)
-        self.btnHeatBed.draw(self.screen)
-        self.btnHeatHotEnd.draw(self.screen)
-        self.btnStartPrint.draw(self.screen)
-        self.btnAbortPrint.draw(self.screen)
-        self.btnPausePrint.draw(self.screen)
-        self.btnConnect.draw(self.screen)
-        self.btnReboot.draw(self.screen)
-        self.btnFan.draw(self.screen)
-        self.btnExit.draw(self.screen)
-
-        # Place temperatures texts
-        text_pos = self.buttonHeight * 2 + 15
-        text_gap = (self.buttonHeight * 2) / 8
-        lbl_hotend_temp = self.fntText.render(u'Hot end:', 1, (220, 0, 0))
-        self.screen.blit(lbl_hotend_temp, (self.leftPadding + self.buttonWidth + self.buttonSpace, text_pos))
-        text_pos += text_gap + (2 if self.enable_graph else 0)
-        lbl_hotend_temp = self.fntText.render(u'{0:.1f}\N{DEGREE SIGN}C ({1:.1f}\N{DEGREE SIGN}C)'.format(self.hotend_temp, self.hotend_temp_target), 1, (220, 0, 0))
-        self.screen.blit(lbl_hotend_temp, (self.leftPadding + self.buttonWidth + self.buttonSpace, text_pos))
-        
-        text_pos += text_gap * 1.5
-        lbl_bed_temp = self.fntText.render(u'Bed:', 1, (66, 100, 255))
-        self.screen.blit(lbl_bed_temp, (self.leftPadding + self.buttonWidth + self.buttonSpace, text_pos))
-        text_pos += text_gap + (2 if self.enable_graph else 0)
-        lbl_bed_temp = self.fntText.render(u'{0:.1f}\N{DEGREE SIGN}C ({1:.1f}\N{DEGREE SIGN}C)'.format(self.bed_temp, self.bed_temp_target), 1, (66, 100, 255))
-        self.screen.blit(lbl_bed_temp, (self.leftPadding + self.buttonWidth + self.buttonSpace, text_pos))
-
-        # Place time left and compeltetion texts
+    def _labels(self):
+        """The status texts as (font, text, color, position)."""
         if self.JobLoaded is False or self.PrintTimeLeft is None or self.Completion is None:
             self.Completion = 0
             self.PrintTimeLeft = 0;
 
-        text_pos += text_gap * 2
-        lbl_print_time_left = self.fntText.render("Time left: {0}".format(datetime.timedelta(seconds = self.PrintTimeLeft)), 1, (200, 200, 200))
-        self.screen.blit(lbl_print_time_left, (self.leftPadding + self.buttonWidth + self.buttonSpace, text_pos))
-
-        text_pos += text_gap * 1.5
-        lbl_completion = self.fntText.render("Completion: {0:.1f}%".format(self.Completion), 1, (200, 200, 200))
-        self.screen.blit(lbl_completion, (self.leftPadding + self.buttonWidth + self.buttonSpace, text_pos))
-
-        # ************************
-        #   Temperature Graphing
-        # ************************
-        
-        if self.enable_graph:
-            # Graph area
-            pygame.draw.rect(self.screen, (255, 255, 255), (self.graph_area_left, self.graph_area_top, self.graph_area_width, self.graph_area_height))
-
-            # Graph axes
-            # X, temp
-            pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left, self.graph_area_top], [self.graph_area_left, self.graph_area_top + self.graph_area_height], 2)
-
-            # X-axis divisions
-            pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 5], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 5], 2) # 0
-            pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 4], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 4], 2) # 50
-            pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 3], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 3], 2) # 100
-            pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 2], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 2], 2) # 150
-            pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 1], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 1], 2) # 200
-            pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 0], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 0], 2) # 250
-
-            # X-axis scale
-            lbl0 = self.fntTextSmall.render("0", 1, (200, 200, 200))
-            self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 5))
-            lbl0 = self.fntTextSmall.render("50", 1, (200, 200, 200))
-            self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 4))
-            lbl0 = self.fntTextSmall.render("100", 1, (200, 200, 200))
-            self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 3))
-            lbl0 = self.fntTextSmall.render("150", 1, (200, 200, 200))
-            self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 2))
-            lbl0 = self.fntTextSmall.render("200", 1, (200, 200, 200))
-            self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 1))
-            lbl0 = self.fntTextSmall.render("250", 1, (200, 200, 200))
-            self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 0))
-
-            # X-axis divisions, grey lines
-            pygame.draw.line(self.screen, (200, 200, 200), [self.graph_area_left + 2, self.graph_area_top + (self.graph_area_height / 5) * 4], [self.graph_area_left + self.graph_area_width - 2, self.graph_area_top + (self.graph_area_height / 5) * 4], 1) # 50
-            pygame.draw.line(self.screen, (200, 200, 200), [self.graph_area_left + 2, self.graph_area_top + (self.graph_area_height / 5) * 3], [self.graph_area_left + self.graph_area_width - 2, self.graph_area_top + (self.graph_area_height / 5) * 3], 1) # 100
-            pygame.draw.line(self.screen, (200, 200, 200), [self.graph_area_left + 2, self.graph_area_top + (self.graph_area_height / 5) * 2], [self.graph_area_left + self.graph_area_width - 2, self.graph_area_top + (self.graph_area_height / 5) * 2], 1) # 150
-            pygame.draw.line(self.screen, (200, 200, 200), [self.graph_area_left + 2, self.graph_area_top + (self.graph_area_height / 5) * 1], [self.graph_area_left + self.graph_area_width - 2, self.graph_area_top + (self.graph_area_height / 5) * 1], 1) # 200
-
-            # Y, time, 2 seconds per pixel
-            pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left, self.graph_area_top + self.graph_area_height], [self.graph_area_left + self.graph_area_width, self.graph_area_top + self.graph_area_height], 2)
-
-            # Scaling factor
-            g_scale = self.graph_area_height / 250.0
-
-            # Print temperatures for hot end
-            i = 0
-            for t in self.HotEndTempList:
-                x = self.graph_area_left + i
-                y = self.graph_area_top + self.graph_area_height - int(t * g_scale)
-                pygame.draw.line(self.screen, (220, 0, 0), [x, y], [x + 1, y], 2)
-                i += 1
-
-            # Print temperatures for bed
-            i = 0
-            for t in self.BedTempList:
-                x = self.graph_area_left + i
-                y = self.graph_area_top + self.graph_area_height - int(t * g_scale)
-                pygame.draw.line(self.screen, (0, 0, 220), [x, y], [x + 1, y], 2)
-                i += 1
-
-            # Draw target temperatures
-            # Hot end
-            pygame.draw.line(self.screen, (180, 40, 40), [self.graph_area_left, self.graph_area_top + self.graph_area_height - (self.hotend_temp_target * g_scale)], [self.graph_area_left + self.graph_area_width, self.graph_area_top + self.graph_area_height - (self.hotend_temp_target * g_scale)], 1)
-            # Bed
-            pygame.draw.line(self.screen, (40, 40, 180), [self.graph_area_left, self.graph_area_top + self.graph_area_height - (self.bed_temp_target * g_scale)], [self.graph_area_left + self.graph_area_width, self.graph_area_top + self.graph_area_height - (self.bed_temp_target * g_scale)], 1)
+        # Temperatures, time left and completion, placed by the layout
+        texts = [
+            (u'Hot end:', (220, 0, 0)),
+            (u'{0:.1f}\N{DEGREE SIGN}C ({1:.1f}\N{DEGREE SIGN}C)'.format(self.hotend_temp, self.hotend_temp_target), (220, 0, 0)),
+            (u'Bed:', (66, 100, 255)),
+            (u'{0:.1f}\N{DEGREE SIGN}C ({1:.1f}\N{DEGREE SIGN}C)'.format(self.bed_temp, self.bed_temp_target), (66, 100, 255)),
+            ("Time left: {0}".format(datetime.timedelta(seconds = self.PrintTimeLeft)), (200, 200, 200)),
+            ("Completion: {0:.1f}%".format(self.Completion), (200, 200, 200)),
+        ]
+        return [(self.fntText, text, color, pos) for (text, color), pos in zip(texts, self.text_positions)]
+
+    def _paint(self, area):
+        """Paint all widgets that overlap area onto the screen surface."""
+        self.screen.fill(self.color_bg, area)
+        self.render_calls += 1
 
-        # update screen
-        pygame.display.update()
+        # Draw buttons
+        for name, btn in self.buttons:
+            if btn.rect.colliderect(area):
+                btn.draw(self.screen)
+                self.render_calls += 1
+
+        # Draw texts
+        for font, text, color, pos in self._labels():
+            lbl = self.text_cache.render(font, text, color)
+            if area.colliderect(pygame.Rect(pos, lbl.get_size())):
+                self.screen.blit(lbl, pos)
+                self.render_calls += 1
+
+        if self.graph_rect is not None and self.graph_rect.colliderect(area):
+            self.graph.draw(self.screen)
+            self.render_calls += 1
+
+        if self.file_list is not None and self.file_list.rect.colliderect(area):
+            self.file_list.draw(self.screen, self.text_cache, self._loaded_file())
+            self.render_calls += 1
+
+        # Last failed command, over whatever is at the bottom
+        failure = self.commands.last_failure
+        status_rect = self._command_status_rect()
+        if failure is not None and status_rect.colliderect(area):
+            self.screen.fill((150, 0, 0), status_rect)
+            self.screen.blit(self.text_cache.render(self.fntText, failure, (255, 255, 255)), (status_rect.left + 4, status_rect.top + 2))
+            self.render_calls += 1
+
+        # Timings overlay on top of everything
+        if self.show_hud:
+            hud_rect = self._hud_rect()
+            if hud_rect.colliderect(area):
+                self.screen.fill((0, 0, 0), hud_rect)
+                for lbl, pos in self._hud_labels():
+                    self.screen.blit(lbl, pos)
+                self.render_calls += 1
 
     def _home_xy(self):
         print "Home XY"
@@ -504,8 +869,8 @@ class OctoPiPanel:
         return
 
     def _z_up(self):
-        print "Z up +" + str(self.z_up_value)
-        data = { "command": "jog", "x": 0, "y": 0, "z": self.z_up_value }
+        print "Z up +" + str(self.settings.z_up_value)
+        data = { "command": "jog", "x": 0, "y": 0, "z": self.settings.z_up_value }
         self._sendAPICommand(self.apiurl_printhead, data)
         return
 
@@ -515,10 +880,11 @@ class OctoPiPanel:
             print "Turning bed off"
             data = { "command": "target", "target": 0 }
         else:
-            print "Heating bed - " + str(self.hotbed_temp) + " degree"
-            data = { "command": "target", "target": self.hotbed_temp }
+            print "Heating bed - " + str(self.settings.hotbed_temp) + " degree"
+            data = { "command": "target", "target": self.settings.hotbed_temp }
 
-        self._sendAPICommand(self.apiurl_bed, data)
+        rollback = self._set_optimistic('HotBed', not self.HotBed)
+        self._sendAPICommand(self.apiurl_bed, data, rollback)
         return
 
     def _heat_hotend(self):
@@ -527,17 +893,19 @@ class OctoPiPanel:
             print "Turning hotend off"
             data = { "command": "target", "targets": { "tool0": 0   } }
         else:
-            print "Heating hotend - " + str(self.hotend_temp) + " degree"
-            data = { "command": "target", "targets": { "tool0": self.hotend_temp } }
+            print "Heating hotend - " + str(self.settings.hotend_temp) + " degree"
+            data = { "command": "target", "targets": { "tool0": self.settings.hotend_temp } }
 
-        self._sendAPICommand(self.apiurl_tool, data)
+        rollback = self._set_optimistic('HotHotEnd', not self.HotHotEnd)
+        self._sendAPICommand(self.apiurl_tool, data, rollback)
         return
 
     def _start_print(self):
-        # here we should display a yes/no box somehow
+        # The file browser, where this button is, shows what will be printed
         print "Start print"
         data = { "command": "start" }
         self._sendAPICommand(self.apiurl_job, data)
+        self._hide_files()
         return
 
     def _abort_print(self):
@@ -570,24 +938,93 @@ class OctoPiPanel:
         if self.FanSpinning:
             print "Turning fan off"
             data = { "commands": ["M107"], "parameters": {} }
-            self.FanSpinning = False
         else:
             print "Turning fan on"
             data = { "commands": ["M106 S255"], "parameters": {} }
-            self.FanSpinning = True
 
-        self._sendAPICommand(self.apiurl_command, data)
+        rollback = self._set_optimistic('FanSpinning', not self.FanSpinning)
+        self._sendAPICommand(self.apiurl_command, data, rollback)
         return
 
     # Connect / disconnect
     def _connect(self):
+        if self.replay is not None:
+            print "Replaying, not connecting"
+            return
+
         if self.connected:
             print "Disconnecting"
             self.connected = False
+            self.rules_changed = True
+            self.poller.pause()
+            if self.push_client is not None:
+                self.push_client.pause()
         else:
             print "Connecting"
             self.connected = True
+            self.rules_changed = True
+            self.poller.resume()
+            if self.push_client is not None:
+                self.push_client.resume()
+
+        return
+
+    # Open the file browser, the listing is fetched again if it's old
+    def _show_files(self):
+        if self.replay is not None:
+            print "Replaying, no files to show"
+            return
+        print "Files"
+        self.files.request()
+        self.show_files = True
+        self._layout()
+        return
+
+    # Back to the main screen
+    def _hide_files(self):
+        if not self.show_files:
+            return
+        self.show_files = False
+        self._layout()
+        return
+
+    def _files_page_up(self):
+        self.file_list.page(-1)
+        self.dirty = True
+        return
 
+    def _files_page_down(self):
+        self.file_list.page(1)
+        self.dirty = True
+        return
+
+    # A row of the file browser was tapped, open the folder or load the file
+    def _file_tapped(self, entry):
+        import filebrowser
+
+        if entry.folder:
+            self._show_folder(entry.path, top=True)
+            return
+
+        print "Load " + entry.name
+        data = { "command": "select" }
+        rollback_name = self._set_optimistic('FileName', entry.name)
+        rollback_loaded = self._set_optimistic('JobLoaded', True)
+
+        def rollback():
+            rollback_name()
+            rollback_loaded()
+        self._sendAPICommand(self.settings.url(filebrowser.select_path(entry)), data, rollback)
+        return
+
+    def _loaded_file(self):
+        """Name of the file OctoPrint has loaded, None if there is none."""
+        return self.FileName if self.JobLoaded else None
+
+    # Show the next zoom level of the temperature graph
+    def _zoom_graph(self):
+        self.graph.set_zoom(self.graph.zoom + 1)
+        print "Graph shows {0}".format(self.graph.zoom_name)
         return
 
     # Exit
@@ -595,16 +1032,50 @@ class OctoPiPanel:
         self.done = True
         return
     
-    # Send API-data to OctoPrint
-    def _sendAPICommand(self, url, data):
-        if self.connected:
-            try:
-                headers = {'content-type': 'application/json', 'X-Api-Key': self.apikey}
-                r = requests.post(url, data=json.dumps(data), headers=headers)
-            except requests.exceptions.ConnectionError as e:
-                print "Connection Error ({0}): {1}".format(e.errno, e.strerror)
+    # Set a status flag before OctoPrint has confirmed it, returns a function that undoes it
+    def _set_optimistic(self, name, value):
+        previous = getattr(self, name)
+        setattr(self, name, value)
+        self.rules_changed = True
+
+        def rollback():
+            setattr(self, name, previous)
+            self.rules_changed = True
+        return rollback
+
+    # Queue API-data to be sent to OctoPrint, on_failure is called if it can't be sent
+    @perfstats.timed('send_command')
+    def _sendAPICommand(self, url, data, on_failure=None):
+        if self.replay is not None:
+            print "Replaying, {0} not sent".format(data)
+        elif self.connected:
+            if not self.commands.submit(url, data, on_failure):
+                print "Too many commands waiting, dropping {0}".format(data)
+                if on_failure is not None:
+                    on_failure()
 
 
 if __name__ == '__main__':
-    opp = OctoPiPanel("OctoPiPanel!")
+    parser = argparse.ArgumentParser(description="Touch screen panel for OctoPrint.")
+    parser.add_argument('--profile-startup', action='store_true', help="Print how long each phase of starting up took, then exit")
+    parser.add_argument('--replay', metavar='FILE', help="Play back a recording made with record_file instead of connecting to OctoPrint")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed, 1 to 100 times as fast as recorded")
+    args = parser.parse_args()
+    if not 1 <= args.speed <= 100:
+        parser.error("--speed must be between 1 and 100")
+
+    try:
+        config = settings.load()
+        if config.printers:
+            # [printer:NAME] sections, show them all on the dashboard
+            if args.replay or args.profile_startup:
+                parser.error("--replay and --profile-startup only work with a single printer")
+            import dashboard
+            use_framebuffer()
+            opp = dashboard.Dashboard(config, "OctoPiPanel!")
+        else:
+            opp = OctoPiPanel("OctoPiPanel!", profile_startup=args.profile_startup, replay=args.replay, replay_speed=args.speed)
+    except settings.SettingsError as e:
+        print "Error in settings: {0}".format(e)
+        sys.exit(1)
     opp.Start()
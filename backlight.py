@@ -0,0 +1,81 @@
+"""
+Backlight control and screen blanking for OctoPiPanel.
+
+The backlight is switched by writing to a sysfs file, on the Adafruit
+PiTFT that is /sys/class/backlight/soc:backlight/brightness. Any other
+file can be used, which makes it easy to try out without a display.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import os
+
+# Where the PiTFT backlight lives with the current kernel driver
+DEFAULT_BACKLIGHT_PATH = '/sys/class/backlight/soc:backlight/brightness'
+
+
+class Backlight(object):
+    def __init__(self, path=None, on_value='1', off_value='0'):
+        """Create a new backlight switch. Parameters:
+            path - File to write on_value/off_value to, None if the backlight
+                can't be switched (the panel then fills the screen black instead)
+            on_value, off_value - What to write to turn the backlight on and off
+            """
+        self.path = path
+        self.on_value = on_value
+        self.off_value = off_value
+        self.is_on = True
+
+    def set(self, on):
+        if on == self.is_on:
+            return
+        self.is_on = on
+
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'w') as f:
+                f.write(self.on_value if on else self.off_value)
+        except IOError as e:
+            print "Could not switch backlight ({0}), disabling backlight control".format(e)
+            self.path = None
+
+
+def default_backlight_path():
+    """The PiTFT backlight file if there is one."""
+    return DEFAULT_BACKLIGHT_PATH if os.path.exists(DEFAULT_BACKLIGHT_PATH) else None
+
+
+class IdleManager(object):
+    """Turns the screen off after `timeout` ms without input, 0 keeps it on."""
+
+    def __init__(self, backlight, timeout):
+        self.backlight = backlight
+        self.timeout = timeout
+        self.last_activity = 0
+
+    @property
+    def screen_on(self):
+        return self.backlight.is_on
+
+    def activity(self, now):
+        """Input happened at `now` ms."""
+        self.last_activity = now
+
+    def wake(self, now):
+        self.last_activity = now
+        self.backlight.set(True)
+
+    def time_until_off(self, now):
+        """ms until the screen turns off, None if it never will or already is."""
+        if not self.timeout or not self.screen_on:
+            return None
+        return max(0, self.last_activity + self.timeout - now)
+
+    def check(self, now):
+        """Turn the screen off if it has been idle for too long, returns True if it just did."""
+        if self.time_until_off(now) == 0:
+            self.backlight.set(False)
+            return True
+        return False
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+Benchmark of the dashboard's polling with many printers, some of them down.
+
+Starts 20 mock OctoPrint servers (benchmarks/mock_octoprint.py) printing,
+and polls them the way the dashboard does: one StatePoller per printer, all
+run by one PollPool. Some of the printers are down, alternately refusing
+connections and accepting them but never answering, which ties up a worker
+for the whole read timeout. Others are broken: they answer, but report a
+chamber temperature that isn't a number, which the panel only trips over
+after the answer was parsed. Measured per case, for the printers that are up:
+
+    first_update_ms     Time from starting the pool to the first update of each
+                        printer, p50/p95/max. The printers that are down come
+                        first in the list, they must not hold the others up.
+    update_gap_ms       Time between two updates of the same printer, p50/p95/max.
+                        Should stay at updatetime however many printers are down.
+    late_updates        Updates that came more than half an updatetime late
+    workers_alive       Worker threads still running at the end, a poll that
+                        fails in an unexpected way must not take one down
+
+The last case turns the pool's reserved worker off, to show what it's for.
+Results are written as one JSON object per line.
+
+Run from the OctoPiPanel folder:
+    python benchmarks/bench_dashboard.py [--printers 20] [--duration 30] [--workers 4] [--output results.jsonl]
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIRECTORY, '..'))
+
+import mock_octoprint
+import perfstats
+import settings
+import statepoller
+
+# (printers down, printers broken, keep a worker for the printers that answer)
+CASES = [
+    (0, 0, True),
+    (5, 0, True),
+    (10, 0, True),
+    (5, 5, True),
+    (10, 0, False),
+]
+
+UPDATETIME = 1000
+
+
+def summary(values):
+    """p50/p95/max of a list of numbers, None if it's empty."""
+    values = sorted(values)
+    if not values:
+        return None
+    return {'p50': perfstats.percentile(values, 50), 'p95': perfstats.percentile(values, 95), 'max': values[-1]}
+
+
+def closed_port():
+    """A local port nothing listens on, connections to it are refused."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(latency=0.0, scenario='printing'):
+    server = mock_octoprint.MockOctoPrint(('127.0.0.1', 0), scenario, latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run_case(printers, down, broken, reserve, workers, duration, warmup):
+    """Poll printers mock servers, down of them not answering and broken more with a bad sensor, for warmup + duration seconds."""
+    import dashboard
+
+    servers = []
+    config = []
+    for i in range(printers):
+        if i < down and i % 2 == 0:
+            # Accepts the connection but never answers
+            server = start_server(latency=3600.0)
+            port = server.server_address[1]
+        elif i < down:
+            server = None
+            port = closed_port()
+        elif i < down + broken:
+            server = start_server(scenario='bad_sensor')
+            port = server.server_address[1]
+        else:
+            server = start_server()
+            port = server.server_address[1]
+        servers.append(server)
+        config.append(settings.PrinterSettings("Printer {0}".format(i + 1), "http://127.0.0.1:{0}".format(port), "BENCHMARK"))
+
+    options = settings.Settings({
+        'updatetime': UPDATETIME,
+        'max_idle_updatetime': 4000,
+        'max_error_updatetime': 8000,
+        'slow_updatetime': 5000,
+        'dashboard_workers': workers,
+    }, printers=config)
+    settings.validate(options)
+
+    # Every published snapshot of the printers that are up, by printer
+    updates = [[] for i in range(printers)]
+    pollers = []
+    for i, printer in enumerate(config):
+        poller = dashboard.create_poller(printer, options)
+        poller.on_update = lambda times=updates[i]: times.append(time.time())
+        pollers.append(poller)
+
+    pool = statepoller.PollPool(pollers, workers)
+    pool.reserve_worker = reserve
+
+    # The panel talks a lot, only the results go to stdout
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        started = time.time()
+        pool.start()
+        time.sleep(warmup + duration)
+        alive = len([thread for thread in pool._threads if thread.is_alive()])
+        pool.stop()
+        pool.join(6)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        for server in servers:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        for poller in pollers:
+            poller.api.close()
+
+    # Gaps after the warmup, the first polls of the printers that are down take a worker each
+    measured_from = started + warmup
+    gaps = []
+    firsts = [(times[0] - started) * 1000.0 for times in updates[down + broken:] if times]
+    for times in updates[down + broken:]:
+        gaps.extend((b - a) * 1000.0 for a, b in zip(times, times[1:]) if b >= measured_from)
+
+    return {
+        'printers': printers,
+        'down': down,
+        'broken': broken,
+        'workers': workers,
+        'workers_alive': alive,
+        'reserve_worker': reserve,
+        'duration': duration,
+        'polls': pool.polls,
+        'updates': len(gaps),
+        'first_update_ms': summary(firsts),
+        'update_gap_ms': summary(gaps),
+        'late_updates': len([gap for gap in gaps if gap > UPDATETIME * 1.5]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's polling with printers that are down.")
+    parser.add_argument('--printers', type=int, default=20, help="Mock servers to poll")
+    parser.add_argument('--workers', type=int, default=4, help="dashboard_workers")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds measured per case")
+    parser.add_argument('--warmup', type=float, default=10.0, help="Seconds per case before measuring")
+    parser.add_argument('--output', help="Append results to this file instead of printing them")
+    args = parser.parse_args()
+
+    output = open(args.output, 'a') if args.output else sys.stdout
+    for down, broken, reserve in CASES:
+        down = min(down, args.printers)
+        broken = min(broken, args.printers - down)
+        result = run_case(args.printers, down, broken, reserve, args.workers, args.duration, args.warmup)
+        output.write(json.dumps(result, sort_keys=True) + '\n')
+        output.flush()
+
+
+if __name__ == '__main__':
+    main()
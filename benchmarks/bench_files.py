@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Benchmark of the file browser.
+
+Times parsing a /api/files listing, and drawing a frame while a folder is
+dragged through, for folders of a few sizes. FileList only draws the rows
+in view; drawing every row of the folder (clipped to the list) is timed as
+well for comparison, that is what scrolling costs without virtualizing.
+
+Run from the OctoPiPanel folder:
+    python benchmarks/bench_files.py [--frames 300]
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIRECTORY, '..'))
+
+import pygame
+
+import filebrowser
+import mock_octoprint
+import textcache
+
+WIDTH = 480
+HEIGHT = 320
+SIZES = [100, 1000, 5000]
+
+
+def drag(file_list, frames):
+    """Motion events dragging the list up by 6 pixels per frame, with a press before and a release after."""
+    x = file_list.rect.centerx
+    y = file_list.rect.bottom - 1
+    events = [pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(x, y), button=1)]
+    for i in range(frames):
+        y -= 6
+        if y < file_list.rect.top:
+            # Let go and grab the list again at the bottom
+            events.append(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=(x, y + 6), button=1))
+            y = file_list.rect.bottom - 1
+            events.append(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(x, y), button=1))
+        events.append(pygame.event.Event(pygame.MOUSEMOTION, pos=(x, y), rel=(0, -6), buttons=(1, 0, 0)))
+    events.append(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=(x, y), button=1))
+    return events
+
+
+def draw_all(file_list, surface, cache):
+    # Every row of the folder, the clip hides the ones out of view
+    clip = surface.get_clip()
+    surface.set_clip(file_list.rect)
+    surface.fill(file_list.color_bg, file_list.rect)
+    y = file_list.rect.top - file_list.offset
+    for entry in file_list.entries:
+        surface.fill(file_list.color_row, (file_list.rect.left, y, file_list.rect.width - 6, file_list.row_height - 2))
+        surface.blit(cache.render(file_list.font, entry.name, file_list.color_text), (file_list.rect.left + 5, y + 5))
+        y += file_list.row_height
+    surface.set_clip(clip)
+
+
+def scroll(file_list, surface, events, draw):
+    """ms per frame, drawing after every motion event."""
+    file_list.offset = 0
+    frames = 0
+    started = time.time()
+    for event in events:
+        file_list.handle(event)
+        if event.type == pygame.MOUSEMOTION:
+            draw()
+            frames += 1
+    return (time.time() - started) * 1000.0 / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the file browser.")
+    parser.add_argument('--frames', type=int, default=300, help="Frames of dragging per folder")
+    args = parser.parse_args()
+
+    pygame.display.init()
+    pygame.font.init()
+    surface = pygame.display.set_mode((WIDTH, HEIGHT))
+    font_path = os.path.join(BENCHMARK_DIRECTORY, '..', 'DejaVuSans.ttf')
+    font = pygame.font.Font(font_path, 14)
+    small_font = pygame.font.Font(font_path, 10)
+
+    print "{0:>6} {1:>10} {2:>12} {3:>12}".format("files", "parse ms", "visible ms", "all rows ms")
+    for count in SIZES:
+        body = json.dumps(mock_octoprint.file_listing(count))
+        started = time.time()
+        folders = filebrowser.parse_files(json.loads(body))
+        parse_ms = (time.time() - started) * 1000.0
+
+        file_list = filebrowser.FileList((5, 5, 305, 310), font, small_font, (41, 61, 70))
+        file_list.show(folders['parts'])
+        events = drag(file_list, args.frames)
+
+        # The panel's cache size, both start out empty
+        cache = textcache.TextCache()
+        visible_ms = scroll(file_list, surface, events, lambda: file_list.draw(surface, cache))
+        cache = textcache.TextCache()
+        all_ms = scroll(file_list, surface, events, lambda: draw_all(file_list, surface, cache))
+
+        print "{0:>6} {1:10.1f} {2:12.2f} {3:12.2f}".format(count, parse_ms, visible_ms, all_ms)
+
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
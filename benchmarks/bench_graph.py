@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for plotting the temperature graph.
+
+Compares a full replot sample by sample (the old per-frame loop) with the
+NumPy/surfarray batch renderer and with the incremental scroll done for every
+new sample, at a few common screen widths.
+
+Run from the OctoPiPanel folder:
+    python benchmarks/bench_graph.py [repeat]
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import os
+import random
+import sys
+import timeit
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import pygame
+
+import tempgraph
+
+# Screen sizes to test, (width, height)
+SCREENS = [(320, 240), (480, 320), (800, 480)]
+
+
+def make_graph(win_width, win_height, font):
+    # Same geometry as OctoPiPanel
+    left = 30
+    top = (win_height / 3) * 2
+    graph = tempgraph.TempGraph(left, top, win_width - left - 5, win_height - top - 5, font, pygame.Color(41, 61, 70))
+
+    random.seed(win_width)
+    for i in range(graph.width):
+        graph.add_sample(random_heaters())
+    return graph
+
+
+def random_heaters():
+    # Stays within one scale, so adding a sample never forces a full replot
+    return [('tool0', random.uniform(20, 240), 200.0), ('bed', random.uniform(20, 110), 60.0)]
+
+
+def bench(func, repeat):
+    """Best time per call in ms."""
+    return min(timeit.repeat(func, number=repeat, repeat=3)) / repeat * 1000.0
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    pygame.display.init()
+    pygame.font.init()
+    font = pygame.font.Font(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'DejaVuSans.ttf'), 10)
+
+    print "NumPy: {0}".format("yes" if tempgraph.load_numpy() is not None else "no (batch renderer skipped)")
+    print "{0:>6} {1:>12} {2:>12} {3:>12}".format("width", "loop ms", "numpy ms", "scroll ms")
+
+    for win_width, win_height in SCREENS:
+        pygame.display.set_mode((win_width, win_height))
+        graph = make_graph(win_width, win_height, font)
+
+        loop_ms = bench(graph._render_series_loop, repeat)
+        if tempgraph.numpy is not None:
+            numpy_ms = "{0:12.3f}".format(bench(graph._render_series_numpy, repeat))
+        else:
+            numpy_ms = "{0:>12}".format("-")
+        scroll_ms = bench(lambda: graph.add_sample(random_heaters()), repeat)
+
+        print "{0:>6} {1:12.3f} {2} {3:12.3f}".format(win_width, loop_ms, numpy_ms, scroll_ms)
+
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
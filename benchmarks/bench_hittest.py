@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Benchmark of resolving taps to buttons.
+
+Lays out twelve buttons like the panel does and times, per event, asking
+every button's handleEvent() in turn against one WidgetRegistry lookup.
+A drag is simulated as a press, a few hundred motion events across the
+screen and a release.
+
+Run from the OctoPiPanel folder:
+    python benchmarks/bench_hittest.py [--drags 200] [--motion 300]
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIRECTORY, '..'))
+
+import pygame
+
+import hittest
+import pygbutton
+
+WIDTH = 480
+HEIGHT = 320
+
+
+def buttons():
+    """Twelve buttons in four rows of three, two pairs sharing a place with one of each hidden."""
+    width = (WIDTH - 30) / 3
+    height = (HEIGHT - 5) / 4 - 5
+    result = []
+    for i in range(12):
+        column, row = i % 3, i / 3
+        btn = pygbutton.PygButton((5 + column * (width + 10), 5 + row * (height + 5), width, height), "Button {0}".format(i))
+        result.append(btn)
+    result[10].rect = result[1].rect
+    result[10].visible = False
+    result[11].rect = result[4].rect
+    result[11].visible = False
+    return result
+
+
+def drag(steps):
+    """A press, steps motion events from corner to corner and a release."""
+    events = [pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(10, 10), button=1)]
+    for i in range(steps):
+        pos = (10 + (WIDTH - 20) * i / steps, 10 + (HEIGHT - 20) * i / steps)
+        events.append(pygame.event.Event(pygame.MOUSEMOTION, pos=pos, rel=(1, 1), buttons=(1, 0, 0)))
+    events.append(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=(WIDTH - 10, HEIGHT - 10), button=1))
+    return events
+
+
+def chain(btns, events):
+    clicks = 0
+    for event in events:
+        for btn in btns:
+            if 'click' in btn.handleEvent(event):
+                clicks += 1
+    return clicks
+
+
+def registry(reg, events):
+    # As in handle_events(), motion is not hit tested
+    for event in events:
+        if event.type != pygame.MOUSEMOTION:
+            reg.dispatch(event, True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark resolving taps to buttons.")
+    parser.add_argument('--drags', type=int, default=200)
+    parser.add_argument('--motion', type=int, default=300, help="Motion events per drag")
+    args = parser.parse_args()
+
+    pygame.display.init()
+    btns = buttons()
+    reg = hittest.WidgetRegistry()
+    for i, btn in enumerate(btns):
+        reg.add("Button {0}".format(i), btn, lambda: None)
+    reg.refresh()
+    events = drag(args.motion)
+    count = args.drags * len(events)
+
+    for name, run in (('handleEvent on every button', lambda: chain(btns, events)),
+                      ('WidgetRegistry', lambda: registry(reg, events))):
+        started = time.time()
+        for i in range(args.drags):
+            run()
+        elapsed = time.time() - started
+        print "{0:<28}{1:8.2f} us per event".format(name, elapsed * 1e6 / count)
+
+    # Lookup alone, for taps
+    points = [(x, y) for x in range(0, WIDTH, 7) for y in range(0, HEIGHT, 7)]
+    started = time.time()
+    for i in range(20):
+        for pos in points:
+            reg.hit(pos)
+    print "{0:<28}{1:8.2f} us per lookup".format('WidgetRegistry.hit', (time.time() - started) * 1e6 / (20 * len(points)))
+
+
+if __name__ == '__main__':
+    main()
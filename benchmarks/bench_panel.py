@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+End to end benchmark of OctoPiPanel against the mock OctoPrint server.
+
+Every scenario runs the whole panel headless (SDL's dummy video driver) in
+its own process, talking to benchmarks/mock_octoprint.py. Taps on a
+button are injected as pygame events while it runs. Measured per scenario:
+
+    fps                 Frames drawn per second
+    cpu_ms_per_frame    CPU time of the whole process per frame drawn
+    requests_per_sec    API requests answered by the mock server
+    input_latency_ms    From a tap until its command reached the server
+    frame_ms, draw_ms, get_state_ms, poll_ms
+                        p50/p95/max from the panel's own timings
+
+Results are written as one JSON object per line.
+
+Run from the OctoPiPanel folder:
+    python benchmarks/bench_panel.py [--duration 10] [--latency 0] [--output results.jsonl] [scenario ...]
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIRECTORY, '..'))
+
+import mock_octoprint
+import perfstats
+
+# Scenarios in the order they are run, with their own settings
+SCENARIOS = [
+    ('idle', {'enable_graph': 'false'}),
+    ('heating', {'enable_graph': 'false'}),
+    ('printing', {'enable_graph': 'true'}),
+    ('flapping', {'enable_graph': 'false'}),
+]
+
+SETTINGS = """[settings]
+baseurl = http://127.0.0.1:{port}
+apikey = BENCHMARK
+full_screen = false
+enable_graph = {enable_graph}
+updatetime = 1000
+idle_updatetime = 1000
+max_idle_updatetime = 4000
+max_error_updatetime = 4000
+slow_updatetime = 5000
+max_fps = 20
+backlightofftime = 0
+stats_file =
+window_width = 480
+window_height = 320
+"""
+
+
+def summary(values):
+    """p50/p95/max of a list of numbers, None if it's empty."""
+    values = sorted(values)
+    if not values:
+        return None
+    return {'p50': perfstats.percentile(values, 50), 'p95': perfstats.percentile(values, 95), 'max': values[-1]}
+
+
+def input_latencies(tapped, received):
+    """ms from each tap to the first command received before the next tap, taps without one are skipped."""
+    latencies = []
+    for i, tap in enumerate(tapped):
+        until = tapped[i + 1] if i + 1 < len(tapped) else float('inf')
+        after = [r for r in received if tap <= r < until]
+        if after:
+            latencies.append((after[0] - tap) * 1000.0)
+    return latencies
+
+
+def run_panel(port, options, duration, taps):
+    """
+    Run the panel for duration seconds against the server on port, in this
+    process. Returns a dict of what was measured in the panel's process.
+    """
+    fd, settings_path = tempfile.mkstemp(suffix='.cfg')
+    with os.fdopen(fd, 'w') as f:
+        f.write(SETTINGS.format(port=port, **options))
+
+    import pygame
+    import OctoPiPanel
+
+    # The panel talks a lot, only the results go to stdout
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        panel = OctoPiPanel.OctoPiPanel("Benchmark", settings_path=settings_path)
+        panel._connect()
+        tapped = []
+
+        def drive():
+            # Tap evenly spread over the run, the first state has arrived by then
+            interval = duration / float(taps + 1)
+            for i in range(taps):
+                time.sleep(interval)
+                for btn in (panel.btnHomeXY, panel.btnPausePrint):
+                    if btn.visible:
+                        break
+                pos = btn.rect.center
+                tapped.append(time.time())
+                pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=pos, button=1))
+                pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=pos, button=1))
+            time.sleep(interval)
+            pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+        driver = threading.Thread(target=drive)
+        driver.daemon = True
+
+        started = time.time()
+        cpu_started = sum(os.times()[:2])
+        driver.start()
+        panel.Start()
+        elapsed = time.time() - started
+        cpu = sum(os.times()[:2]) - cpu_started
+
+        # Let the background threads finish before the interpreter goes down
+        for thread in (panel.poller, panel.commands):
+            thread.join(5)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.remove(settings_path)
+
+    stats = panel.perf.summary()
+    frames = stats['frame']['count'] if stats.get('frame') else 0
+    return {
+        'duration': elapsed,
+        'frames': frames,
+        'fps': frames / elapsed,
+        'cpu_ms_per_frame': cpu * 1000.0 / frames if frames else None,
+        'cpu_percent': cpu * 100.0 / elapsed,
+        'failed_requests': panel.api.failures,
+        'tapped': tapped,
+        'frame_ms': stats.get('frame'),
+        'draw_ms': stats.get('draw'),
+        'get_state_ms': stats.get('get_state'),
+        'poll_ms': stats.get('GET /api/printer'),
+    }
+
+
+def run_scenario(name, options, duration, latency, taps):
+    """
+    Run one scenario, the panel in a process of its own so pygame and the CPU
+    time start from scratch. Returns the result dict, None if the panel failed.
+    """
+    server = mock_octoprint.MockOctoPrint(('127.0.0.1', 0), name, latency / 1000.0)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    command = [sys.executable, os.path.realpath(__file__), '--run-panel', str(server.server_address[1]),
+               '--duration', str(duration), '--taps', str(taps), name]
+    try:
+        child = subprocess.Popen(command, stdout=subprocess.PIPE)
+        out = child.communicate()[0].strip()
+    finally:
+        server.shutdown()
+    if child.returncode != 0 or not out:
+        return None
+
+    result = json.loads(out.splitlines()[-1])
+    tapped = result.pop('tapped')
+    received = [t for t, path, body in server.commands]
+    result.update({
+        'scenario': name,
+        'latency_injected_ms': latency,
+        'requests': server.requests,
+        'requests_per_sec': server.requests / result['duration'],
+        'taps': len(tapped),
+        'commands_received': len(received),
+        'input_latency_ms': summary(input_latencies(tapped, received)),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OctoPiPanel against a mock OctoPrint server.")
+    parser.add_argument('scenarios', nargs='*', help="Scenarios to run, all of {0} by default".format(', '.join(name for name, options in SCENARIOS)))
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument('--latency', type=float, default=0.0, help="ms added to every mock server response")
+    parser.add_argument('--taps', type=int, default=5, help="Button taps per scenario")
+    parser.add_argument('--output', help="Append results to this file instead of printing them")
+    parser.add_argument('--run-panel', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    options = dict(SCENARIOS)
+    names = args.scenarios or [name for name, o in SCENARIOS]
+    for name in names:
+        if name not in options:
+            parser.error("Unknown scenario {0}".format(name))
+
+    if args.run_panel:
+        # Child process started by run_scenario()
+        print json.dumps(run_panel(args.run_panel, options[names[0]], args.duration, args.taps))
+        return
+
+    output = open(args.output, 'a') if args.output else sys.stdout
+    failed = False
+    for name in names:
+        result = run_scenario(name, options[name], args.duration, args.latency, args.taps)
+        if result is None:
+            sys.stderr.write("Scenario {0} failed\n".format(name))
+            failed = True
+            continue
+        output.write(json.dumps(result, sort_keys=True) + '\n')
+        output.flush()
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
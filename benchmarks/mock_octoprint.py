@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Stand-in OctoPrint server for benchmarks.
+
+Serves the parts of the REST API OctoPiPanel uses, /api/printer,
+/api/job, /api/connection, /api/files and /api/login, with responses
+scripted by a scenario: a function of the seconds since the server started. Every
+response can be delayed to simulate a slow network or a busy Pi, and POSTed
+commands are recorded with the time they arrived.
+
+Usage:
+    python benchmarks/mock_octoprint.py [scenario] [port] [latency ms] [files]
+
+and set baseurl = http://localhost:<port> in OctoPiPanel.cfg.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import json
+import math
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+def idle(t):
+    return {
+        'state': 'Operational',
+        'tool0': (22.0, 0.0),
+        'bed': (21.5, 0.0),
+        'file': None,
+        'completion': None,
+        'left': None,
+    }
+
+
+def heating(t):
+    # Approaches the targets like a heater does, slower the closer it gets
+    return {
+        'state': 'Operational',
+        'tool0': (210.0 - 188.0 * math.exp(-t / 30.0), 210.0),
+        'bed': (60.0 - 38.5 * math.exp(-t / 60.0), 60.0),
+        'file': 'benchmark.gcode',
+        'completion': None,
+        'left': None,
+    }
+
+
+def printing(t):
+    return {
+        'state': 'Printing',
+        'tool0': (210.0 + 1.5 * math.sin(t), 210.0),
+        'bed': (60.0 + 0.5 * math.sin(t / 3.0), 60.0),
+        'file': 'benchmark.gcode',
+        'completion': min(100.0, t / 36.0),
+        'left': max(0, int(3600 - t)),
+    }
+
+
+def flapping(t):
+    # Heating while the network drops out for 2 seconds out of every 5
+    state = heating(t)
+    state['down'] = t % 5.0 >= 3.0
+    return state
+
+
+def bad_sensor(t):
+    # Idle, with a heated chamber whose sensor reports text instead of a temperature
+    state = idle(t)
+    state['chamber'] = ('n/a', 40.0)
+    return state
+
+
+def file_listing(count):
+    """/api/files?recursive=true with a few files at the top and count of them in the parts folder."""
+    def machinecode(path):
+        return {'name': path.rpartition('/')[2], 'path': path, 'type': 'machinecode', 'origin': 'local',
+                'size': 100000 + len(path) * 4321, 'date': 1500000000}
+
+    parts = [machinecode('parts/part_{0:05d}.gcode'.format(i)) for i in range(count)]
+    return {
+        'files': [
+            machinecode('benchmark.gcode'),
+            machinecode('calibration cube.gcode'),
+            {'name': 'parts', 'path': 'parts', 'type': 'folder', 'origin': 'local', 'children': parts},
+            {'name': 'model.stl', 'path': 'model.stl', 'type': 'model', 'origin': 'local', 'size': 5000},
+        ],
+        'free': 1000000000,
+    }
+
+
+SCENARIOS = {
+    'idle': idle,
+    'heating': heating,
+    'printing': printing,
+    'flapping': flapping,
+    'bad_sensor': bad_sensor,
+}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one go, headers and body in separate packets
+    #  would add delayed ACK waits to the measured latency
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        state = self.server.current()
+        if state is None:
+            self.close_connection = 1
+            return
+        path = self.path.split('?')[0]
+
+        if path == '/api/printer':
+            temperature = {}
+            for name in ('tool0', 'bed', 'chamber'):
+                if name in state:
+                    temperature[name] = {'actual': state[name][0], 'target': state[name][1]}
+            self._send_json({
+                'temperature': temperature,
+                'state': {'text': state['state']},
+            })
+        elif path == '/api/job':
+            self._send_json({
+                'job': {'file': {'name': state['file']}},
+                'progress': {'completion': state['completion'], 'printTimeLeft': state['left']},
+            })
+        elif path == '/api/connection':
+            self._send_json({'current': {'state': state['state']}})
+        elif path == '/api/files':
+            # Conditional like OctoPrint's, the listing never changes
+            if self.headers.get('If-None-Match') == self.server.files_etag:
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self._send_body(self.server.files_body, etag=self.server.files_etag)
+        else:
+            self._send_json({'error': 'Not found'}, 404)
+
+    def do_POST(self):
+        received = time.time()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.current() is None:
+            self.close_connection = 1
+            return
+        path = self.path.split('?')[0]
+
+        if path == '/api/login':
+            self._send_json({'name': '_api', 'session': 'mock'})
+            return
+
+        self.server.record_command(received, path, body)
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_json(self, obj, status=200):
+        self._send_body(json.dumps(obj), status)
+
+    def _send_body(self, body, status=200, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockOctoPrint(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, scenario='idle', latency=0.0, files=50):
+        """Create a new server. Parameters:
+            address - (host, port) to listen on, port 0 picks a free one
+            scenario - Name of one of SCENARIOS
+            latency - Seconds to wait before every response
+            files - Number of files in the parts folder of /api/files
+            """
+        HTTPServer.__init__(self, address, MockHandler)
+        self.scenario = SCENARIOS[scenario]
+        self.latency = latency
+        self.started = time.time()
+        self.requests = 0
+        self.commands = [] # (time received, path, body)
+        self.files_body = json.dumps(file_listing(files))
+        self.files_etag = '"files-{0}"'.format(files)
+        self._lock = threading.Lock()
+
+    def current(self):
+        """
+        Scripted state for now, after the injected latency. None when the
+        network is down, the connection is then dropped without an answer.
+        """
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        state = self.scenario(time.time() - self.started)
+        return None if state.get('down') else state
+
+    def record_command(self, received, path, body):
+        with self._lock:
+            self.commands.append((received, path, body))
+
+
+def main():
+    scenario = sys.argv[1] if len(sys.argv) > 1 else 'printing'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    latency = float(sys.argv[3]) / 1000.0 if len(sys.argv) > 3 else 0.0
+    files = int(sys.argv[4]) if len(sys.argv) > 4 else 50
+
+    server = MockOctoPrint(('', port), scenario, latency, files)
+    print "Mock OctoPrint '{0}' on port {1}".format(scenario, port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Asynchronous sending of button commands to OctoPrint.
+
+Commands are queued and posted from a background thread so a tap never
+waits for OctoPrint. Consecutive jog commands still waiting in the queue
+are merged into one move. Results are collected and handed back to the
+pygame loop by process_results(), which runs any rollback of optimistic UI
+changes for commands that failed and keeps a short description of the last
+failure for the panel to show.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import threading
+from collections import deque
+
+import requests
+
+
+class Command(object):
+    def __init__(self, url, data, on_failure=None):
+        """A command to post. Parameters:
+            url - The API URL to post to
+            data - The JSON data to post
+            on_failure - Called from the pygame loop if the command fails,
+                used to roll back optimistic UI changes
+            """
+        self.url = url
+        self.data = data
+        self.on_failure = on_failure
+
+    def merge(self, other):
+        """Merge other into this command if both are jogs, returns True if merged."""
+        if self.url != other.url or self.data.get('command') != 'jog' or other.data.get('command') != 'jog':
+            return False
+
+        for axis in ('x', 'y', 'z'):
+            if axis in self.data or axis in other.data:
+                self.data[axis] = self.data.get(axis, 0) + other.data.get(axis, 0)
+
+        if other.on_failure is not None:
+            previous = self.on_failure
+            def on_failure():
+                if previous is not None:
+                    previous()
+                other.on_failure()
+            self.on_failure = on_failure
+        return True
+
+
+class CommandDispatcher(threading.Thread):
+    def __init__(self, api, max_pending=8, on_done=None):
+        """Create a new dispatcher. Parameters:
+            api - The OctoPrintAPI to post with
+            max_pending - Commands that may wait in the queue, more are refused
+            on_done - Called from the dispatcher thread after each command
+            """
+        threading.Thread.__init__(self, name="CommandDispatcher")
+        self.daemon = True
+
+        self.api = api
+        self.max_pending = max_pending
+        self.on_done = on_done
+
+        self._pending = deque()
+        self._results = deque() # (command, error message or None)
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        # What failed last, like "home failed: Timeout", None once a command got through
+        self.last_failure = None
+
+        # Statistics
+        self.sent = 0
+        self.merged = 0
+        self.failed = 0
+
+    def submit(self, url, data, on_failure=None):
+        """Queue a command, returns False if the queue is full."""
+        command = Command(url, dict(data), on_failure)
+        with self._cond:
+            if self._pending and self._pending[-1].merge(command):
+                self.merged += 1
+                return True
+            if len(self._pending) >= self.max_pending:
+                return False
+            self._pending.append(command)
+            self._cond.notify()
+        return True
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                command = self._pending.popleft()
+
+            error = self._post(command)
+            self._results.append((command, error))
+            if self.on_done is not None:
+                self.on_done()
+
+    def _post(self, command):
+        """Send a command, returns an error message or None."""
+        self.sent += 1
+        try:
+            req = self.api.post(command.url, command.data)
+        except requests.exceptions.ConnectionError as e:
+            return "Connection Error: {0}".format(e)
+        except requests.exceptions.Timeout as e:
+            return "Timeout: {0}".format(e)
+        except requests.exceptions.RequestException as e:
+            # Anything else requests gives up on, like a cut off answer or a redirect loop
+            return "Request failed: {0!r}".format(e)
+
+        if req.status_code >= 400:
+            return "Error {0}: {1}".format(req.status_code, req.text)
+        return None
+
+    def process_results(self):
+        """
+        Handle finished commands, call from the pygame loop. Returns the
+        number of failed commands that were rolled back.
+        """
+        failed = 0
+        while self._results:
+            command, error = self._results.popleft()
+            if error is None:
+                self.last_failure = None
+                continue
+
+            self.failed += 1
+            failed += 1
+            print "Command failed ({0}): {1}".format(command.data.get('command', command.data), error)
+            # G-code commands have "commands" instead of a "command"
+            self.last_failure = "{0} failed: {1}".format(command.data.get('command', 'G-code'), error.split(':')[0])
+            if command.on_failure is not None:
+                command.on_failure()
+        return failed
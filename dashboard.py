@@ -0,0 +1,280 @@
+"""
+Dashboard mode, one screen showing several printers as compact tiles.
+
+Every [printer:NAME] section of OctoPiPanel.cfg gets its own OctoPrintAPI,
+StatePoller and PollScheduler, so each printer backs off on its own. The
+pollers share a PollPool of dashboard_workers threads, which keeps a worker
+free for the printers that answer however many others are down.
+
+A tile is only redrawn when what it shows has changed. Tapping a tile polls
+that printer right away, Escape or q quits.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import datetime
+import math
+import os
+import time
+
+import pygame
+
+import octoprintapi
+import perfstats
+import statepoller
+import textcache
+
+# Posted by the pool's workers after every poll
+STATE_EVENT = pygame.USEREVENT + 1
+# Timer event used to wake up the idle main loop
+WAKEUP_EVENT = pygame.USEREVENT + 2
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+
+STATUS_COLORS = {
+    "Printing": (0, 200, 0),
+    "Paused": (230, 180, 0),
+    "Idle": (200, 200, 200),
+    "Connecting": (120, 120, 120),
+    "Offline": (200, 0, 0),
+}
+
+
+def create_poller(printer, settings):
+    """A StatePoller for one PrinterSettings, to be run by a PollPool."""
+    # Only the pool's worker uses the session, one connection is enough
+    api = octoprintapi.OctoPrintAPI(printer.baseurl, printer.apikey, pool_size=1)
+    scheduler = statepoller.PollScheduler(settings.updatetime, settings.idle_updatetime, settings.max_idle_updatetime, settings.max_error_updatetime)
+    return statepoller.StatePoller(api, api.url('/api/printer'), api.url('/api/job'), api.url('/api/connection'),
+                                   settings.updatetime, slow_interval=settings.slow_updatetime, scheduler=scheduler)
+
+
+def tile_content(name, state, offline):
+    """What a tile shows, as a tuple that only changes when the tile has to be redrawn."""
+    if offline:
+        status = "Offline"
+    elif state.seq == 0:
+        status = "Connecting"
+    elif state.Paused:
+        status = "Paused"
+    elif state.Printing:
+        status = "Printing"
+    else:
+        status = "Idle"
+
+    temps = "E {0:.0f}/{1:.0f}  B {2:.0f}/{3:.0f}".format(state.hotend_temp, state.hotend_temp_target, state.bed_temp, state.bed_temp_target)
+
+    completion = None
+    job = ""
+    if state.JobLoaded and state.Completion is not None:
+        completion = int(state.Completion)
+        job = "{0}%  {1} left".format(completion, datetime.timedelta(seconds=state.PrintTimeLeft or 0))
+    return (name, status, temps, completion, job)
+
+
+def grid(count, width, height, aspect=2.0):
+    """(columns, rows) for count tiles on a width x height screen, tiles as close to aspect wide as can be."""
+    best = None
+    for columns in range(1, count + 1):
+        rows = int(math.ceil(count / float(columns)))
+        ratio = (width / float(columns)) / (height / float(rows))
+        fit = abs(math.log(ratio / aspect))
+        if best is None or fit < best[0]:
+            best = (fit, columns, rows)
+    return best[1], best[2]
+
+
+class Dashboard(object):
+
+    def __init__(self, settings, caption="OctoPiPanel dashboard"):
+        self.settings = settings
+        self.caption = caption
+        self.done = False
+        self.waited_events = []
+        self.color_bg = pygame.Color(41, 61, 70)
+        self.color_tile = pygame.Color(55, 80, 92)
+
+        # Frame and draw timings, printed on exit
+        self.perf = perfstats.PerfStats()
+
+        pygame.display.init()
+        pygame.font.init()
+        # The clock also starts SDL's timer, pygame.time.get_ticks() is 0 without it
+        self.clock = pygame.time.Clock()
+        # Don't queue events nothing looks at, like mouse motion and key releases
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONUP, STATE_EVENT, WAKEUP_EVENT])
+        if settings.full_screen:
+            self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        else:
+            self.screen = pygame.display.set_mode((settings.window_width, settings.window_height))
+        pygame.display.set_caption(caption)
+
+        # One poller per printer, all polled by the same few threads
+        self.printers = [(printer.name, create_poller(printer, settings)) for printer in settings.printers]
+        self.pool = statepoller.PollPool([poller for name, poller in self.printers], settings.dashboard_workers, on_poll=self._post_state_event)
+
+        # Every tile has a handful of texts
+        self.text_cache = textcache.TextCache(size=max(64, 8 * len(self.printers)))
+        self.fonts = {}
+        self._layout()
+
+        print "Dashboard initiated, {0} printers".format(len(self.printers))
+
+    def _font(self, size):
+        """DejaVuSans bold in size points, loaded once."""
+        font = self.fonts.get(size)
+        if font is None:
+            font = self.fonts[size] = pygame.font.Font(os.path.join(SCRIPT_DIRECTORY, "DejaVuSans.ttf"), size)
+            font.set_bold(True)
+        return font
+
+    def _layout(self):
+        """Place the tiles in a grid filling the screen, with fonts to match their size."""
+        width, height = self.screen.get_size()
+        columns, rows = grid(len(self.printers), width, height)
+        tile_width = width / columns
+        tile_height = height / rows
+        gap = 3
+        self.grid = (columns, tile_width, tile_height)
+
+        self.tiles = []
+        for i in range(len(self.printers)):
+            column, row = i % columns, i / columns
+            self.tiles.append(pygame.Rect(column * tile_width + gap, row * tile_height + gap, tile_width - gap * 2, tile_height - gap * 2))
+
+        # Name and status, temperatures and job on three lines, the progress bar below
+        self.fntName = self._font(max(9, min(24, tile_height / 5)))
+        self.fntText = self._font(max(8, min(18, tile_height / 7)))
+
+        # Tile contents as last drawn, by index
+        self.drawn = {}
+        self.full_redraw = True
+
+    def Start(self):
+        print "Dashboard started!"
+        print "---"
+        self.pool.start()
+
+        while not self.done:
+            frame_started = time.time()
+            self.handle_events()
+            if self.draw():
+                self.perf.add('frame', (time.time() - frame_started) * 1000.0)
+
+            # Cap the frame rate, and sleep until a poll is done or something else happens
+            self.clock.tick(self.settings.max_fps)
+            if not self.done and not pygame.event.peek():
+                self._wait_for_event(self.settings.updatetime)
+
+        print "Dashboard is going down."
+        self.pool.stop()
+        self.pool.join(1)
+        print "Polls: {0} made by {1} workers".format(self.pool.polls, self.pool.workers)
+        for name, poller in self.printers:
+            print "{0}: {requests} requests, {failures} failed".format(name, **poller.api.stats())
+            poller.api.close()
+        for line in self.perf.lines(['frame', 'draw']):
+            print line
+        pygame.quit()
+
+    def handle_events(self):
+        events = self.waited_events + pygame.event.get()
+        self.waited_events = []
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                print "Quit"
+                self.done = True
+            elif event.type == pygame.KEYDOWN and event.key in (pygame.K_ESCAPE, pygame.K_q):
+                self.done = True
+            elif event.type == pygame.MOUSEBUTTONUP:
+                # Tapping a tile fetches that printer's state right away
+                index = self._tile_at(event.pos)
+                if index is not None:
+                    self.pool.poke(self.printers[index][1])
+
+    def _tile_at(self, pos):
+        """Index of the tile at pos, worked out from the grid, None between tiles."""
+        columns, tile_width, tile_height = self.grid
+        x, y = pos
+        if x < 0 or y < 0 or x >= columns * tile_width:
+            return None
+        index = y / tile_height * columns + x / tile_width
+        if index >= len(self.tiles) or not self.tiles[index].collidepoint(pos):
+            return None
+        return index
+
+    @perfstats.timed('draw')
+    def draw(self):
+        """Redraw the tiles whose content changed, returns True if anything was drawn."""
+        full = self.full_redraw
+        if full:
+            self.screen.fill(self.color_bg)
+            self.drawn = {}
+            self.full_redraw = False
+
+        updated = []
+        for i, ((name, poller), rect) in enumerate(zip(self.printers, self.tiles)):
+            content = tile_content(name, poller.state, poller.failed_polls > 0)
+            if self.drawn.get(i) == content:
+                continue
+            self.drawn[i] = content
+            self._paint_tile(rect, content)
+            updated.append(rect)
+
+        if full:
+            pygame.display.flip()
+        elif updated:
+            pygame.display.update(updated)
+        return full or bool(updated)
+
+    def _paint_tile(self, rect, content):
+        name, status, temps, completion, job = content
+        color = STATUS_COLORS[status]
+        text_color = (200, 200, 200) if status != "Offline" else (120, 120, 120)
+
+        # Long names are cut off at the tile's edge
+        clip = self.screen.get_clip()
+        self.screen.set_clip(rect.clip(clip))
+        self.screen.fill(self.color_tile, rect)
+        pygame.draw.rect(self.screen, color, (rect.left, rect.top, 3, rect.height))
+
+        x = rect.left + 7
+        y = rect.top + 3
+        lbl = self.text_cache.render(self.fntName, status, color)
+        self.screen.blit(lbl, (rect.right - lbl.get_width() - 4, y))
+        lbl = self.text_cache.render(self.fntName, name, (255, 255, 255))
+        self.screen.blit(lbl, (x, y))
+        y += lbl.get_height()
+
+        lbl = self.text_cache.render(self.fntText, temps, text_color)
+        self.screen.blit(lbl, (x, y))
+        y += lbl.get_height()
+        if job:
+            lbl = self.text_cache.render(self.fntText, job, text_color)
+            self.screen.blit(lbl, (x, y))
+            y += lbl.get_height()
+
+        if completion is not None:
+            bar_height = max(3, rect.height / 10)
+            bar = pygame.Rect(x, rect.bottom - bar_height - 4, rect.right - x - 4, bar_height)
+            if bar.top >= y:
+                pygame.draw.rect(self.screen, text_color, bar, 1)
+                self.screen.fill(color, (bar.left, bar.top, bar.width * min(completion, 100) / 100, bar.height))
+        self.screen.set_clip(clip)
+
+    def _wait_for_event(self, timeout):
+        """Block until an event arrives or timeout ms has passed."""
+        pygame.time.set_timer(WAKEUP_EVENT, timeout)
+        event = pygame.event.wait()
+        pygame.time.set_timer(WAKEUP_EVENT, 0)
+
+        if event.type not in (WAKEUP_EVENT, STATE_EVENT):
+            self.waited_events.append(event)
+
+    def _post_state_event(self):
+        # Called from a pool worker, SDL's event queue is thread safe
+        if pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(STATE_EVENT))
@@ -0,0 +1,348 @@
+"""
+G-code file browser, backed by OctoPrint's /api/files.
+
+FileListing fetches the whole listing, all folders at once, from a
+background thread and keeps it until it's older than max_age or has been
+invalidated (when OctoPrint pushes an UpdatedFiles event or baseurl
+changes). Fetching again is a conditional request, so an unchanged listing
+costs a 304 and no parsing. A fetch that failed is tried again after
+retry_delay seconds.
+
+FileList shows one folder as rows. Only the rows that are on screen are
+drawn, their texts come from the panel's TextCache, so scrolling a folder
+with thousands of files costs the same as scrolling one with ten.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import threading
+import time
+import urllib
+from collections import namedtuple
+
+import pygame
+import requests
+
+# A file or folder. path is relative to the origin, '' for the top folder.
+FileEntry = namedtuple('FileEntry', ['name', 'path', 'folder', 'origin', 'size'])
+
+# Shown at the top of every folder but the top one
+PARENT_NAME = '..'
+
+
+def parse_files(data):
+    """
+    Folder path -> FileEntry list for a /api/files?recursive=true response.
+    Folders come first, then files, both by name. Only G-code files are
+    listed, models can't be printed.
+    """
+    folders = {'': []}
+
+    def add(children, origin, parent):
+        entries = folders.setdefault(parent, [])
+        for child in children:
+            kind = child.get('type')
+            path = child.get('path') or child['name']
+            if kind == 'folder':
+                entries.append(FileEntry(child['name'], path, True, origin, None))
+                folders.setdefault(path, [])
+                add(child.get('children', ()), origin, path)
+            elif kind == 'machinecode':
+                entries.append(FileEntry(child['name'], path, False, origin, child.get('size')))
+
+    for entry in data.get('files', ()):
+        add([entry], entry.get('origin', 'local'), '')
+
+    for entries in folders.values():
+        entries.sort(key=lambda e: (not e.folder, e.name.lower()))
+    return folders
+
+
+def parent_folder(path):
+    return path.rpartition('/')[0]
+
+
+def select_path(entry):
+    """API path that selects (loads) the file entry."""
+    path = entry.path.encode('utf-8') if isinstance(entry.path, unicode) else entry.path
+    return '/api/files/{0}/{1}'.format(entry.origin, urllib.quote(path))
+
+
+def format_size(size):
+    if size is None:
+        return ""
+    if size < 1024:
+        return "{0} B".format(size)
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024.0
+        if size < 1024 or unit == 'GB':
+            return "{0:.1f} {1}".format(size, unit)
+
+
+class FileListing(threading.Thread):
+    # Seconds between fetches while the listing can't be fetched
+    retry_delay = 5.0
+
+    def __init__(self, api, url, max_age, on_done=None):
+        """Create a new listing. Parameters:
+            api - The OctoPrintAPI to fetch with
+            url - The /api/files URL, with recursive=true
+            max_age - Seconds a listing is used before it's fetched again
+            on_done - Called from the listing thread after every fetch
+            """
+        threading.Thread.__init__(self, name="FileListing")
+        self.daemon = True
+
+        self.api = api
+        self.url = url
+        self.max_age = max_age
+        self.on_done = on_done
+
+        # Replaced as a whole by the listing thread, never changed in place
+        self.folders = {}
+        self.error = None
+        self.fetched = None     # time.time() the listing in folders was asked for
+        self.asked = None       # time.time() the last fetch was started
+        self.invalidated = 0.0  # Listings asked for before this are stale
+        self.version = 0        # Goes up when folders or error change
+        self.fetches = 0
+
+        self._cond = threading.Condition()
+        self._wanted = False
+        self._fetching = False
+        self._stopped = False
+
+    def configure(self, url, max_age):
+        """Use another URL (new baseurl) or max_age, a listing from another URL is stale."""
+        if url != self.url:
+            self.url = url
+            self.invalidate()
+        self.max_age = max_age
+
+    def invalidate(self):
+        """The files on OctoPrint have changed, the next request() fetches them."""
+        self.invalidated = time.time()
+
+    def stale(self):
+        now = time.time()
+        if self.error is not None:
+            return now - self.asked >= self.retry_delay
+        fetched = self.fetched
+        return fetched is None or fetched < self.invalidated or now - fetched > self.max_age
+
+    def request(self):
+        """Fetch the listing in the background if it's stale. Returns True if a fetch is on its way."""
+        with self._cond:
+            if self._wanted or self._fetching:
+                return True
+            if not self.stale():
+                return False
+            self._wanted = True
+            self._cond.notify()
+        return True
+
+    def entries(self, folder):
+        """FileEntry list of a folder, with the parent folder first below the top. None if there's no such folder."""
+        entries = self.folders.get(folder)
+        if entries is None:
+            return None
+        if folder:
+            return [FileEntry(PARENT_NAME, parent_folder(folder), True, None, None)] + entries
+        return entries
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._wanted and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                self._wanted = False
+                self._fetching = True
+
+            try:
+                self._fetch()
+            finally:
+                with self._cond:
+                    self._fetching = False
+            if self.on_done is not None:
+                self.on_done()
+
+    def _fetch(self):
+        # A listing asked for before an invalidate() is stale, even if it arrives after it
+        asked = self.asked = time.time()
+        self.fetches += 1
+        try:
+            status, data, changed = self.api.get_json(self.url)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            self._set_error("Can't reach OctoPrint")
+            print "File listing failed: {0}".format(e)
+            return
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # Something else answered, like a proxy's error or login page, or the answer was cut short
+            self._set_error("Unexpected listing")
+            print "Unexpected file listing: {0!r}".format(e)
+            return
+
+        if status != 200:
+            self._set_error("Error {0}".format(status))
+            return
+        if changed or self.error is not None or not self.folders:
+            try:
+                self.folders = parse_files(data)
+            except (KeyError, TypeError, AttributeError) as e:
+                self._set_error("Unexpected listing")
+                print "Unexpected file listing: {0!r}".format(e)
+                return
+            self.error = None
+            self.version += 1
+        self.fetched = asked
+
+    def _set_error(self, error):
+        if error != self.error:
+            self.error = error
+            self.version += 1
+
+
+class FileList(object):
+    """Rows of a folder in a scrollable area, drag to scroll and tap to pick a row."""
+
+    color_row = (55, 80, 92)
+    color_highlight = (70, 110, 70)
+    color_text = (230, 230, 230)
+    color_folder = (255, 220, 120)
+    color_detail = (160, 170, 175)
+
+    def __init__(self, rect, font, small_font, color_bg):
+        self.rect = pygame.Rect(rect)
+        self.font = font
+        self.small_font = small_font
+        self.color_bg = color_bg
+        self.row_height = font.get_linesize() + 10
+
+        self.entries = []
+        self.message = None
+        self.shown = 0  # Goes up with every show()
+        self.offset = 0 # Pixels scrolled down
+
+        # Pointer position while pressed inside the list, and if it was dragged
+        self._pressed = None
+        self._dragged = False
+
+    @property
+    def dragging(self):
+        return self._pressed is not None
+
+    def show(self, entries, message=None, top=False):
+        """Show other entries, or message instead when there are none. Keeps the scroll position unless top is True."""
+        self.entries = entries
+        self.message = message
+        self.shown += 1
+        if top:
+            self.offset = 0
+        self.scroll(0)
+
+    def max_offset(self):
+        return max(0, len(self.entries) * self.row_height - self.rect.height)
+
+    def scroll(self, pixels):
+        """Scroll down by pixels, up if negative. Returns True if the list moved."""
+        offset = min(max(0, self.offset + pixels), self.max_offset())
+        moved = offset != self.offset
+        self.offset = offset
+        return moved
+
+    def page(self, pages):
+        """Scroll down by whole pages, up if negative, keeping one row of the last page in view."""
+        per_page = max(1, self.rect.height / self.row_height - 1)
+        row = self.offset / self.row_height + pages * per_page
+        return self.scroll(max(0, row) * self.row_height - self.offset)
+
+    def row_at(self, pos):
+        """Index of the entry at pos, None if there isn't one."""
+        if not self.rect.collidepoint(pos):
+            return None
+        index = (pos[1] - self.rect.top + self.offset) / self.row_height
+        return index if index < len(self.entries) else None
+
+    def handle(self, event):
+        """
+        Handle a mouse event. A press and release without dragging in
+        between is a tap, returns the index of the tapped entry or None.
+        """
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if self.rect.collidepoint(event.pos):
+                self._pressed = event.pos
+                self._dragged = False
+            return None
+
+        if self._pressed is None:
+            return None
+        if event.type == pygame.MOUSEMOTION:
+            # Only a drag of more than a third of a row, a tap wobbles a little
+            if not self._dragged and abs(event.pos[1] - self._pressed[1]) * 3 < self.row_height:
+                return None
+            self._dragged = True
+            self.scroll(self._pressed[1] - event.pos[1])
+            self._pressed = event.pos
+            return None
+
+        pressed, self._pressed = self._pressed, None
+        if self._dragged:
+            return None
+        return self.row_at(event.pos)
+
+    def key(self, highlight):
+        """Changes whenever the list looks different."""
+        return (self.shown, self.offset, tuple(self.rect), highlight)
+
+    def draw(self, surface, text_cache, highlight=None):
+        """Draw the rows in view, the one named highlight stands out."""
+        clip = surface.get_clip()
+        surface.set_clip(self.rect.clip(clip))
+        surface.fill(self.color_bg, self.rect)
+
+        if not self.entries:
+            if self.message:
+                lbl = text_cache.render(self.font, self.message, self.color_detail)
+                surface.blit(lbl, (self.rect.left + 5, self.rect.top + 5))
+            surface.set_clip(clip)
+            return
+
+        # Only the rows that are at least partly in view
+        height = self.row_height
+        first = self.offset / height
+        last = min(len(self.entries), (self.offset + self.rect.height - 1) / height + 1)
+        y = self.rect.top + first * height - self.offset
+        width = self.rect.width - 6
+        for entry in self.entries[first:last]:
+            row = pygame.Rect(self.rect.left, y, width, height - 2)
+            surface.fill(self.color_highlight if not entry.folder and entry.name == highlight else self.color_row, row)
+
+            text_y = y + (height - 2 - self.font.get_linesize()) / 2
+            if entry.folder:
+                lbl = text_cache.render(self.font, entry.name + "/", self.color_folder)
+            else:
+                lbl = text_cache.render(self.font, entry.name, self.color_text)
+                detail = text_cache.render(self.small_font, format_size(entry.size), self.color_detail)
+                detail_x = row.right - detail.get_width() - 5
+                surface.blit(detail, (detail_x, y + (height - 2 - detail.get_height()) / 2))
+                # Long names are cut off before the size
+                surface.set_clip(pygame.Rect(row.left, row.top, detail_x - row.left - 5, row.height).clip(self.rect).clip(clip))
+            surface.blit(lbl, (row.left + 5, text_y))
+            surface.set_clip(self.rect.clip(clip))
+            y += height
+
+        # Where in the folder the rows are, when it doesn't fit
+        total = len(self.entries) * height
+        if total > self.rect.height:
+            thumb = max(10, self.rect.height * self.rect.height / total)
+            top = (self.rect.height - thumb) * self.offset / self.max_offset()
+            surface.fill(self.color_detail, (self.rect.right - 4, self.rect.top + top, 4, thumb))
+        surface.set_clip(clip)
@@ -0,0 +1,91 @@
+"""
+Finding the button under a tap and running what it does.
+
+WidgetRegistry keeps the visible buttons in a grid of CELL_SIZE pixel
+cells, every cell holding the few buttons that overlap it. Finding the
+button under the pointer is then a lookup and a collidepoint or two,
+however many buttons there are, instead of asking every button in turn.
+The grid is only rebuilt when a button is shown, hidden or moved.
+
+A click is a press and a release on the same button, as with PygButton's
+handleEvent(), and calls the handler registered for the button.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import pygame
+
+CELL_SIZE = 16
+
+
+class WidgetRegistry(object):
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.pressed = None # Name of the widget the pointer went down on
+
+        self._widgets = [] # (name, widget)
+        self._handlers = {} # name -> (handler, works while disconnected)
+        self._key = None
+        self._columns = 0
+        self._cells = []
+
+    def add(self, name, widget, handler, always=False):
+        """Register a widget, anything with rect and visible. handler is called when it's clicked,
+        only while connected to OctoPrint unless always is True."""
+        self._widgets.append((name, widget))
+        self._handlers[name] = (handler, always)
+        self._key = None
+
+    def refresh(self):
+        """Rebuild the grid if a widget was shown, hidden or moved. Returns True if it was rebuilt."""
+        key = tuple((widget.visible, tuple(widget.rect)) for name, widget in self._widgets)
+        if key == self._key:
+            return False
+        self._key = key
+
+        visible = [(name, pygame.Rect(widget.rect)) for name, widget in self._widgets if widget.visible]
+        size = self.cell_size
+        self._columns = max([rect.right for name, rect in visible] or [0]) / size + 1
+        rows = max([rect.bottom for name, rect in visible] or [0]) / size + 1
+        cells = [()] * (self._columns * rows)
+        for name, rect in visible:
+            for row in range(max(0, rect.top) / size, (rect.bottom - 1) / size + 1):
+                for column in range(max(0, rect.left) / size, (rect.right - 1) / size + 1):
+                    index = row * self._columns + column
+                    cells[index] = cells[index] + ((name, rect),)
+        self._cells = cells
+        return True
+
+    def hit(self, pos):
+        """Name of the visible widget at pos, None if there is none."""
+        x, y = pos
+        column = x / self.cell_size
+        if x < 0 or y < 0 or column >= self._columns:
+            return None
+        index = y / self.cell_size * self._columns + column
+        if index >= len(self._cells):
+            return None
+        for name, rect in self._cells[index]:
+            if rect.collidepoint(pos):
+                return name
+        return None
+
+    def dispatch(self, event, connected):
+        """
+        Handle a MOUSEBUTTONDOWN or MOUSEBUTTONUP event. Calls the handler of
+        the widget that was clicked and returns its name, None if nothing was.
+        """
+        name = self.hit(event.pos)
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            self.pressed = name
+            return None
+
+        pressed, self.pressed = self.pressed, None
+        if name is None or name != pressed:
+            return None
+        handler, always = self._handlers[name]
+        if not (always or connected):
+            return None
+        handler()
+        return name
@@ -0,0 +1,149 @@
+"""
+Shared HTTP client for the OctoPrint REST API.
+
+All API traffic goes through one pooled requests.Session so TCP (and TLS)
+connections are kept alive and reused between polls and commands. The API
+key is sent once per request as the X-Api-Key header.
+
+get_json() remembers the last response per URL, makes the request
+conditional when the server sent an ETag or Last-Modified header and only
+decodes the JSON when the body has actually changed.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import json
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Last response of a URL fetched with get_json()
+CachedResponse = namedtuple('CachedResponse', ['etag', 'last_modified', 'body', 'data'])
+
+
+class OctoPrintAPI(object):
+    def __init__(self, baseurl, apikey, connect_timeout=3.05, read_timeout=5, pool_size=4):
+        """Create a new API client. Parameters:
+            baseurl - URL to the OctoPrint installation, e.g. http://localhost:5000
+            apikey - The OctoPrint API key
+            connect_timeout - Seconds to wait for a TCP connection
+            read_timeout - Seconds to wait for a response once connected
+            pool_size - Number of keep-alive connections held per host. The
+                poller and button commands run in different threads, so
+                this should be at least 2.
+            """
+        self.baseurl = baseurl.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        self.session.headers.update({'X-Api-Key': apikey})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0   # Requests sent
+        self.failures = 0   # Requests that raised a ConnectionError or Timeout
+        self.not_modified = 0 # 304 answers to conditional requests
+        self.unchanged = 0  # 200 answers with the same body as last time, not parsed again
+
+        self._responses = {}
+
+        # Called with (method, path, ms) after every request, from the thread that made it
+        self.on_timing = None
+
+    def configure(self, baseurl, apikey):
+        """Talk to another OctoPrint installation or use another API key."""
+        self.baseurl = baseurl.rstrip('/')
+        self.session.headers.update({'X-Api-Key': apikey})
+        self._responses = {}
+
+    def url(self, path):
+        """Full URL for an API path such as /api/job."""
+        return self.baseurl + path
+
+    def get(self, url, **kwargs):
+        return self._request('GET', url, **kwargs)
+
+    def get_json(self, url, **kwargs):
+        """
+        GET url and decode the JSON body. Returns (status_code, data, changed)
+        where changed is False when data is the same as last time. data is
+        None if the status code isn't 200. kwargs go to requests, e.g. timeout.
+        """
+        cached = self._responses.get(url)
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        req = self.get(url, headers=headers, **kwargs)
+        if req.status_code == 304 and cached is not None:
+            with self._lock:
+                self.not_modified += 1
+            return 200, cached.data, False
+
+        if req.status_code != 200:
+            return req.status_code, None, True
+
+        body = req.content
+        if cached is not None and body == cached.body:
+            with self._lock:
+                self.unchanged += 1
+            data = cached.data
+            changed = False
+        else:
+            data = json.loads(body)
+            changed = True
+
+        self._responses[url] = CachedResponse(req.headers.get('ETag'), req.headers.get('Last-Modified'), body, data)
+        return 200, data, changed
+
+    def post(self, url, data, **kwargs):
+        headers = {'content-type': 'application/json'}
+        return self._request('POST', url, data=json.dumps(data), headers=headers, **kwargs)
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        with self._lock:
+            self.requests += 1
+        started = time.time()
+        try:
+            return self.session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            if self.on_timing is not None:
+                path = url[len(self.baseurl):] if url.startswith(self.baseurl) else url
+                self.on_timing(method, path, (time.time() - started) * 1000.0)
+
+    def stats(self):
+        """Counters for requests sent and TCP connections opened/reused."""
+        connections = 0
+        pooled_requests = 0
+        for adapter in set(self.session.adapters.values()):
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools[key]
+                connections += pool.num_connections
+                pooled_requests += pool.num_requests
+
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'not_modified': self.not_modified,
+            'unchanged': self.unchanged,
+            'connections': connections,
+            'reused': max(0, pooled_requests - connections),
+        }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,182 @@
+"""
+Client for OctoPrint's push API.
+
+OctoPrint pushes "current" messages over SockJS whenever something changes,
+so there's no need to poll the REST API while the socket is up. The client
+feeds the pushed state into the StatePoller's state model and tells it to
+stop polling; when the socket drops, polling takes over again until the
+client has reconnected.
+
+Requires the websocket-client Python module.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import json
+import random
+import socket
+import threading
+
+import requests
+
+import statepoller
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+
+class PushClient(threading.Thread):
+    def __init__(self, api, poller, throttle=1, timeout=60, reconnect_delay=1.0, max_reconnect_delay=30.0):
+        """Create a new push client. Parameters:
+            api - The OctoPrintAPI used to log in and to find the server
+            poller - The StatePoller to publish state to
+            throttle - Send current messages every throttle * 500 ms at most
+            timeout - Seconds without any frame before the socket is considered dead,
+                OctoPrint sends a heartbeat every 25 seconds
+            reconnect_delay, max_reconnect_delay - Seconds to wait before reconnecting,
+                doubled after every failed attempt
+            """
+        threading.Thread.__init__(self, name="PushClient")
+        self.daemon = True
+
+        self.api = api
+        self.poller = poller
+        self.throttle = throttle
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.ws = None
+        self.messages = 0 # Messages received, for statistics
+        # Called from the client thread when OctoPrint says its files have changed
+        self.on_files_changed = None
+        self._active = threading.Event()
+        self._stopped = threading.Event()
+
+    def resume(self):
+        self._active.set()
+
+    def pause(self):
+        self._active.clear()
+        self._abort()
+
+    def stop(self):
+        self._stopped.set()
+        self._active.set()
+        self._abort()
+
+    def url(self):
+        """SockJS websocket URL, with a random server and session id as the SockJS protocol wants."""
+        base = self.api.baseurl.replace('https://', 'wss://', 1).replace('http://', 'ws://', 1)
+        return '{0}/sockjs/{1:03d}/{2:08x}/websocket'.format(base, random.randint(0, 999), random.getrandbits(32))
+
+    def run(self):
+        delay = self.reconnect_delay
+        while not self._stopped.is_set():
+            # Sleep until connected
+            self._active.wait()
+            if self._stopped.is_set():
+                break
+
+            try:
+                self._session()
+                delay = self.reconnect_delay
+            except (websocket.WebSocketException, socket.error, requests.exceptions.RequestException, ValueError) as e:
+                if self._active.is_set():
+                    print "Push connection lost: {0}".format(e)
+            finally:
+                # Fall back to polling the REST API
+                self.poller.push_active = False
+                self._close()
+
+            self._stopped.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _session(self):
+        """Connect and handle frames until the socket is closed."""
+        # Other threads may abort the socket at any time, only this thread replaces or forgets it
+        ws = self.ws = websocket.create_connection(self.url(), timeout=self.timeout)
+
+        frame = ws.recv()
+        if frame != 'o':
+            raise ValueError("Unexpected SockJS open frame: {0!r}".format(frame))
+
+        # Since OctoPrint 1.3.10 the socket needs to be authenticated to get any state
+        req = self.api.post(self.api.url('/api/login'), {'passive': True})
+        if req.status_code == 200:
+            user = req.json()
+            self._send(ws, {'auth': '{0}:{1}'.format(user['name'], user['session'])})
+        self._send(ws, {'throttle': self.throttle})
+
+        print "Push connection established"
+        self.poller.push_active = True
+
+        while self._active.is_set() and not self._stopped.is_set():
+            frame = ws.recv()
+            if not frame:
+                raise ValueError("Socket closed")
+            self._handle_frame(frame)
+
+    def _send(self, ws, message):
+        # SockJS clients send a JSON array of JSON-encoded messages
+        ws.send(json.dumps([json.dumps(message)]))
+
+    def _abort(self):
+        """Make the client thread drop the socket, from any thread."""
+        ws = self.ws
+        if ws is not None:
+            try:
+                # Wakes up a recv() blocking in the client thread right away, a send() fails
+                ws.abort()
+            except (websocket.WebSocketException, socket.error):
+                pass
+
+    def _close(self):
+        # Only called from the client thread
+        ws = self.ws
+        self.ws = None
+        if ws is not None:
+            try:
+                ws.close()
+            except (websocket.WebSocketException, socket.error):
+                pass
+
+    def _handle_frame(self, frame):
+        kind = frame[0]
+        if kind == 'h':
+            # Heartbeat
+            return
+        if kind == 'c':
+            raise ValueError("Closed by server: {0}".format(frame[1:]))
+        if kind != 'a':
+            return
+
+        for message in json.loads(frame[1:]):
+            if isinstance(message, basestring):
+                message = json.loads(message)
+            self.messages += 1
+
+            # The history message has the same layout as current, with all stored temperatures
+            for key in ('current', 'history'):
+                if key in message:
+                    self._handle_current(message[key])
+
+            event = message.get('event')
+            if event and event.get('type') == 'UpdatedFiles' and self.on_files_changed is not None:
+                self.on_files_changed()
+
+    def _handle_current(self, current):
+        values = {}
+        try:
+            if current.get('temps'):
+                # Only the latest temperatures are used, one sample per update like when polling
+                statepoller.parse_temperatures(current['temps'][-1], values)
+            statepoller.parse_job(current, current['state']['text'], values)
+        except (KeyError, TypeError, AttributeError) as e:
+            print "Unexpected push message: {0!r}".format(e)
+            return
+
+        self.poller.publish(values)
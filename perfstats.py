@@ -0,0 +1,106 @@
+"""
+Timing statistics for OctoPiPanel.
+
+Frame times, poll latencies and such are kept as a window of the most
+recent samples per name, so the percentiles show how the panel is doing
+now rather than since it started. Recording a sample is an append; the
+percentiles are only worked out when they are shown or written to file.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import functools
+import json
+import math
+import threading
+import time
+from collections import deque
+
+
+def percentile(values, pct):
+    """The pct percentile of a sorted, non-empty list, by nearest rank."""
+    index = max(0, int(math.ceil(pct / 100.0 * len(values))) - 1)
+    return values[index]
+
+
+class RollingStats(object):
+    """The last `size` samples of one measurement."""
+
+    def __init__(self, size=500):
+        self.samples = deque(maxlen=size)
+        self.count = 0 # All samples ever added
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def summary(self):
+        """Dict of count, p50, p95 and max, None if nothing was added."""
+        values = sorted(self.samples)
+        if not values:
+            return None
+        return {
+            'count': self.count,
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'max': values[-1],
+        }
+
+
+class PerfStats(object):
+    """RollingStats by name. Samples may be added from any thread."""
+
+    def __init__(self, size=500):
+        self.size = size
+        self.started = time.time()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = RollingStats(self.size)
+            stats.add(value)
+
+    def summary(self):
+        """Summaries of all measurements, by name."""
+        with self._lock:
+            return dict((name, stats.summary()) for name, stats in self._stats.items())
+
+    def lines(self, names):
+        """'name p50/p95/max' text for the given measurements that have samples."""
+        summary = self.summary()
+        lines = []
+        for name in names:
+            s = summary.get(name)
+            if s is not None:
+                lines.append("{0} {1:.1f}/{2:.1f}/{3:.1f}".format(name, s['p50'], s['p95'], s['max']))
+        return lines
+
+    def names(self):
+        with self._lock:
+            return sorted(self._stats.keys())
+
+    def dump(self, path, info=None):
+        """Write the summaries and the info dict as JSON to path."""
+        data = dict(info or {})
+        data['uptime'] = time.time() - self.started
+        data['stats'] = self.summary()
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+
+def timed(name):
+    """Method decorator recording the time of each call in ms under name in self.perf."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            started = time.time()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.perf.add(name, (time.time() - started) * 1000.0)
+        return wrapper
+    return decorator
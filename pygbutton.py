@@ -35,6 +35,8 @@ The views and conclusions contained in the software and documentation are those
 authors and should not be interpreted as representing official policies, either expressed
 or implied, of Al Sweigart.
 """
+from collections import OrderedDict
+
 import pygame
 from pygame.locals import *
 
@@ -47,6 +49,11 @@ DARKGRAY  = ( 64,  64,  64)
 GRAY      = (128, 128, 128)
 LIGHTGRAY = (212, 208, 200)
 
+# Rendered button surfaces shared by all buttons, keyed by everything that
+# affects their appearance. Least recently used surfaces are dropped first.
+SURFACE_CACHE_SIZE = 32
+_surfaceCache = OrderedDict()
+
 class PygButton(object):
     def __init__(self, rect=None, caption='', bgcolor=LIGHTGRAY, fgcolor=BLACK, font=None):
         """Create a new button object. Parameters:
@@ -80,7 +87,6 @@ class PygButton(object):
         self.lastMouseDownOverButton = False # was the last mouse down event over the mouse button? (Used to track clicks.)
         self._visible = True # is the button visible
 
-        self.surfaceNormal = pygame.Surface(self._rect.size)
         self._update() # draw the initial button images
 
     def handleEvent(self, eventObj):
@@ -164,28 +170,43 @@ class PygButton(object):
 
     def _update(self):
         """Redraw the button's Surface object. Call this method when the button has changed appearance."""
+        key = (self._caption, tuple(self._bgcolor), tuple(self._fgcolor), self._rect.size, self._font)
+
+        surf = _surfaceCache.pop(key, None)
+        if surf is None:
+            surf = self._render()
+            if len(_surfaceCache) >= SURFACE_CACHE_SIZE:
+                _surfaceCache.popitem(last=False)
+        _surfaceCache[key] = surf # (re)insert as most recently used
+
+        # Note that the surface may be shared with other buttons looking the same, don't draw on it.
+        self.surfaceNormal = surf
 
+
+    def _render(self):
+        """Render a new Surface object with the button's current appearance."""
         w = self._rect.width # syntactic sugar
         h = self._rect.height # syntactic sugar
+        surf = pygame.Surface(self._rect.size)
 
         # fill background color for all buttons
-        self.surfaceNormal.fill(self.bgcolor)
+        surf.fill(self.bgcolor)
 
         # draw caption text for all buttons
         captionSurf = self._font.render(self._caption, True, self.fgcolor, self.bgcolor)
         captionRect = captionSurf.get_rect()
         captionRect.center = int(w / 2), int(h / 2)
-        self.surfaceNormal.blit(captionSurf, captionRect)
+        surf.blit(captionSurf, captionRect)
 
         # draw border for normal button
-        pygame.draw.rect(self.surfaceNormal, BLACK, pygame.Rect((0, 0, w, h)), 1) # black border around everything
-        pygame.draw.line(self.surfaceNormal, WHITE, (1, 1), (w - 2, 1))
-        pygame.draw.line(self.surfaceNormal, WHITE, (1, 1), (1, h - 2))
-        pygame.draw.line(self.surfaceNormal, DARKGRAY, (1, h - 1), (w - 1, h - 1))
-        pygame.draw.line(self.surfaceNormal, DARKGRAY, (w - 1, 1), (w - 1, h - 1))
-        pygame.draw.line(self.surfaceNormal, GRAY, (2, h - 2), (w - 2, h - 2))
-        pygame.draw.line(self.surfaceNormal, GRAY, (w - 2, 2), (w - 2, h - 2))
-
+        pygame.draw.rect(surf, BLACK, pygame.Rect((0, 0, w, h)), 1) # black border around everything
+        pygame.draw.line(surf, WHITE, (1, 1), (w - 2, 1))
+        pygame.draw.line(surf, WHITE, (1, 1), (1, h - 2))
+        pygame.draw.line(surf, DARKGRAY, (1, h - 1), (w - 1, h - 1))
+        pygame.draw.line(surf, DARKGRAY, (w - 1, 1), (w - 1, h - 1))
+        pygame.draw.line(surf, GRAY, (2, h - 2), (w - 2, h - 2))
+        pygame.draw.line(surf, GRAY, (w - 2, 2), (w - 2, h - 2))
+        return surf
 
 
     def mouseClick(self, event):
@@ -207,6 +228,8 @@ class PygButton(object):
 
 
     def _propSetCaption(self, captionText):
+        if captionText == self._caption:
+            return # nothing to redraw
         self._caption = captionText
         self._update()
 
@@ -217,8 +240,13 @@ class PygButton(object):
 
     def _propSetRect(self, newRect):
         # Note that changing the attributes of the Rect won't update the button. You have to re-assign the rect member.
-        self._update()
+        newRect = pygame.Rect(newRect)
+        if newRect == self._rect:
+            return
+        resized = newRect.size != self._rect.size
         self._rect = newRect
+        if resized:
+            self._update()
 
 
     def _propGetVisible(self):
@@ -234,6 +262,8 @@ class PygButton(object):
 
 
     def _propSetFgColor(self, setting):
+        if setting == self._fgcolor:
+            return
         self._fgcolor = setting
         self._update()
 
@@ -243,6 +273,8 @@ class PygButton(object):
 
 
     def _propSetBgColor(self, setting):
+        if setting == self._bgcolor:
+            return
         self._bgcolor = setting
         self._update()
 
@@ -252,6 +284,8 @@ class PygButton(object):
 
 
     def _propSetFont(self, setting):
+        if setting == self._font:
+            return
         self._font = setting
         self._update()
 
@@ -0,0 +1,150 @@
+"""
+Screen layouts read from a data file, layout.json by default.
+
+A screen lists its buttons with the grid cell they sit in, the rules for
+when they are shown and what they say, and where the status texts and the
+temperature graph go. Geometry is worked out once per screen and window
+size and kept, so changing back to a size seen before costs nothing.
+
+Rules are only evaluated by apply(), which the panel calls when the printer
+state or the connection has changed, never on every frame.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import json
+from collections import namedtuple
+
+import pygame
+
+from settings import SettingsError
+
+# Names the visible and captions rules may use, the panel works out their values
+CONDITIONS = ('idle', 'busy', 'paused', 'job_loaded', 'hot_hotend', 'hot_bed', 'fan_spinning', 'connected')
+
+# Where everything on a screen goes at one window size
+Geometry = namedtuple('Geometry', [
+    'buttons',          # name -> pygame.Rect
+    'text_positions',   # (x, y) of every status text line
+    'graph',            # pygame.Rect, None if the screen has no graph
+    'file_list',        # pygame.Rect, None if the screen has no file list
+    'font_size',
+    'small_font_size',  # None if the screen has no graph or file list
+])
+
+
+def _fraction(value, fraction):
+    numerator, denominator = fraction
+    return value / denominator * numerator
+
+
+class ScreenLayout(object):
+    def __init__(self, path):
+        """Read the screens from the JSON file at path, raises SettingsError."""
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError) as e:
+            raise SettingsError("Can't read layout {0}: {1}".format(path, e))
+
+        self.screens = {}
+        definitions = data.get('screens', {})
+        for name in definitions:
+            self.screens[name] = self._resolve(definitions, name, ())
+        self._geometry = {}
+
+    def _resolve(self, definitions, name, seen):
+        """The screen called name with the keys of the screen it extends filled in."""
+        if name in seen:
+            raise SettingsError("Screen {0} in {1} extends itself".format(name, self.path))
+        if name not in definitions:
+            raise SettingsError("No screen called {0} in {1}".format(name, self.path))
+        screen = dict(definitions[name])
+        base = screen.pop('extends', None)
+        if base is not None:
+            resolved = dict(self._resolve(definitions, base, seen + (name,)))
+            resolved.update(screen)
+            screen = resolved
+
+        for button in screen.get('buttons', ()):
+            for condition in list(button.get('visible', [])) + [c for c, caption in button.get('captions', [])]:
+                if condition not in CONDITIONS:
+                    raise SettingsError("Unknown condition {0} for {1} in {2}".format(condition, button['name'], self.path))
+        return screen
+
+    def screen(self, name):
+        screen = self.screens.get(name)
+        if screen is None:
+            raise SettingsError("No screen called {0} in {1}".format(name, self.path))
+        return screen
+
+    def buttons(self, name, values):
+        """(name, caption, color) of the buttons on a screen in drawing order, captions formatted with the values dict."""
+        return [(button['name'], button['caption'].format(**values), tuple(button.get('color', ())) or None)
+                for button in self.screen(name)['buttons']]
+
+    def geometry(self, name, width, height):
+        """Geometry of a screen in a width x height window, worked out the first time it's asked for."""
+        key = (name, width, height)
+        geometry = self._geometry.get(key)
+        if geometry is None:
+            geometry = self._geometry[key] = self._compute(self.screen(name), width, height)
+        return geometry
+
+    def _compute(self, screen, width, height):
+        grid = screen['grid']
+        columns, rows = grid['columns'], grid['rows']
+        margin, gap = grid['margin'], grid['gap']
+        spacing = grid['narrow_spacing'] if width <= grid.get('narrow_width', 0) else grid['spacing']
+
+        button_width = (width - margin * 2 - spacing * (columns - 1)) / columns
+        button_height = _fraction(height - margin, grid['height']) / rows - gap
+
+        def cell(column, row):
+            return (margin + column * (button_width + spacing), margin + row * (button_height + gap))
+
+        buttons = {}
+        for button in screen['buttons']:
+            buttons[button['name']] = pygame.Rect(cell(*button['cell']), (button_width, button_height))
+
+        # Status texts, a text_gap of the button height apart
+        text_positions = []
+        if 'text_cell' in screen:
+            x, y = cell(*screen['text_cell'])
+            text_gap = _fraction(button_height, screen['text_gap'])
+            for step, extra in zip(screen['text_steps'], screen['text_extra']):
+                y += text_gap * step + extra
+                text_positions.append((x, y))
+
+        graph = screen.get('graph')
+        if graph is not None:
+            top = _fraction(height, graph['top'])
+            graph = pygame.Rect(graph['left'], top, width - graph['left'] - graph['right'], height - top - graph['bottom'])
+
+        # The file list covers the cells from its top left to its bottom right one
+        file_list = screen.get('file_list')
+        if file_list is not None:
+            first, last = file_list['cells']
+            left, top = cell(*first)
+            right, bottom = cell(*last)
+            file_list = pygame.Rect(left, top, right + button_width - left, bottom + button_height - top)
+
+        return Geometry(buttons, text_positions, graph, file_list, screen['font_size'], screen.get('small_font_size'))
+
+    def apply(self, name, buttons, conditions, values):
+        """
+        Show, hide and caption the buttons of a screen by its rules. buttons
+        maps names to PygButtons, conditions maps every name in CONDITIONS to
+        True or False and captions are formatted with the values dict.
+        """
+        for button in self.screen(name)['buttons']:
+            btn = buttons[button['name']]
+            btn.visible = all(conditions[c] for c in button.get('visible', ()))
+            caption = button['caption']
+            for condition, text in button.get('captions', ()):
+                if conditions[condition]:
+                    caption = text
+                    break
+            btn.caption = caption.format(**values)
@@ -0,0 +1,181 @@
+"""
+Settings for OctoPiPanel, read from OctoPiPanel.cfg.
+
+The file is parsed and validated once into a Settings object. load() keeps
+the parsed settings and only reads the file again when it has changed, so
+reloading (on SIGHUP) is cheap when nothing was edited.
+
+Every [printer:NAME] section adds a printer to the dashboard, with its own
+baseurl and apikey. baseurl and apikey in [settings] are then not needed.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import os
+from collections import namedtuple
+from ConfigParser import RawConfigParser, Error as ConfigParserError
+
+import backlight
+
+SECTION = 'settings'
+# Sections named [printer:NAME] describe the printers shown by the dashboard
+PRINTER_PREFIX = 'printer:'
+
+# The path used when the file isn't given
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "OctoPiPanel.cfg")
+
+# Options as (name, type, default). A default of None means the option is required.
+OPTIONS = (
+    ('baseurl', str, None),
+    ('apikey', str, None),
+    ('updatetime', int, None),
+    ('window_width', int, 320),
+    ('window_height', int, 240),
+    ('full_screen', bool, False),
+    ('enable_graph', bool, True),
+    ('hotend_temp', int, 190),
+    ('hotbed_temp', int, 50),
+    ('z_up_value', int, 25),
+    ('idle_updatetime', int, 0),   # 0 means updatetime
+    ('max_idle_updatetime', int, 16000),
+    ('max_error_updatetime', int, 60000),
+    ('slow_updatetime', int, 10000),
+    ('push_updates', bool, False),
+    ('max_fps', int, 20),
+    ('backlightofftime', int, 30000),
+    ('backlight_path', str, ''),   # Empty means the PiTFT backlight if there is one
+    ('show_hud', bool, False),
+    ('stats_file', str, 'OctoPiPanel-stats.json'), # Empty to not write timings on exit
+    ('record_file', str, ''),      # Empty to not record printer state
+    ('dashboard_workers', int, 4), # Threads polling the dashboard's printers
+    ('layout_file', str, 'layout.json'), # Screens and buttons, next to OctoPiPanel.py
+    ('files_updatetime', int, 60000), # How long the file listing is used before it's fetched again
+)
+
+# One [printer:NAME] section
+PrinterSettings = namedtuple('PrinterSettings', ['name', 'baseurl', 'apikey'])
+
+
+class SettingsError(ValueError):
+    """The settings file is missing, can't be parsed or has an invalid value."""
+
+
+class Settings(object):
+    def __init__(self, values, path=None, printers=()):
+        """Settings from a dict of option name to value, see OPTIONS, and a list of PrinterSettings."""
+        self.path = path
+        self.printers = tuple(printers)
+        for name, kind, default in OPTIONS:
+            setattr(self, name, values.get(name, default))
+
+    def __eq__(self, other):
+        return isinstance(other, Settings) and self.as_dict() == other.as_dict() and self.printers == other.printers
+
+    def __ne__(self, other):
+        return not self == other
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name, kind, default in OPTIONS)
+
+    def changed(self, other):
+        """Names of the options that differ from other."""
+        return set(name for name, kind, default in OPTIONS if getattr(self, name) != getattr(other, name))
+
+    def url(self, path):
+        """Full URL for an API path such as /api/job."""
+        return self.baseurl.rstrip('/') + path
+
+
+def parse(path):
+    """Read and validate a settings file, raises SettingsError."""
+    cfg = RawConfigParser()
+    try:
+        with open(path, 'r') as f:
+            cfg.readfp(f)
+    except (IOError, ConfigParserError) as e:
+        raise SettingsError("Can't read {0}: {1}".format(path, e))
+
+    printers = parse_printers(cfg, path)
+
+    values = {}
+    for name, kind, default in OPTIONS:
+        if not cfg.has_option(SECTION, name):
+            # The dashboard has a baseurl and apikey per printer
+            if default is None and not (printers and name in ('baseurl', 'apikey')):
+                raise SettingsError("{0} is missing from the [{1}] section of {2}".format(name, SECTION, path))
+            continue
+        try:
+            if kind is bool:
+                values[name] = cfg.getboolean(SECTION, name)
+            elif kind is int:
+                values[name] = cfg.getint(SECTION, name)
+            else:
+                values[name] = cfg.get(SECTION, name).strip()
+        except ValueError:
+            raise SettingsError("{0} = {1!r} in {2} is not a valid {3}".format(name, cfg.get(SECTION, name), path, kind.__name__))
+
+    settings = Settings(values, path, printers)
+    validate(settings)
+    return settings
+
+
+def parse_printers(cfg, path):
+    """PrinterSettings for the [printer:NAME] sections, in the order of the file."""
+    printers = []
+    for section in cfg.sections():
+        if not section.startswith(PRINTER_PREFIX):
+            continue
+        name = section[len(PRINTER_PREFIX):].strip()
+        if not name:
+            raise SettingsError("[{0}] in {1} has no printer name".format(section, path))
+        for option in ('baseurl', 'apikey'):
+            if not cfg.has_option(section, option):
+                raise SettingsError("{0} is missing from the [{1}] section of {2}".format(option, section, path))
+        printers.append(PrinterSettings(name, cfg.get(section, 'baseurl').strip(), cfg.get(section, 'apikey').strip()))
+    return printers
+
+
+def _check_url(name, url):
+    if not url.startswith(('http://', 'https://')):
+        raise SettingsError("{0} must start with http:// or https://, not {1!r}".format(name, url))
+
+
+def validate(settings):
+    """Check the values and fill in defaults that depend on other values, raises SettingsError."""
+    if settings.baseurl is not None:
+        _check_url('baseurl', settings.baseurl)
+    for printer in settings.printers:
+        _check_url("baseurl of printer {0}".format(printer.name), printer.baseurl)
+
+    for name in ('updatetime', 'window_width', 'window_height', 'max_idle_updatetime', 'max_error_updatetime', 'slow_updatetime', 'max_fps', 'dashboard_workers', 'files_updatetime'):
+        if getattr(settings, name) <= 0:
+            raise SettingsError("{0} must be greater than 0".format(name))
+    for name in ('idle_updatetime', 'hotend_temp', 'hotbed_temp', 'backlightofftime'):
+        if getattr(settings, name) < 0:
+            raise SettingsError("{0} can't be negative".format(name))
+
+    if settings.idle_updatetime == 0:
+        settings.idle_updatetime = settings.updatetime
+    if not settings.backlight_path:
+        settings.backlight_path = backlight.default_backlight_path()
+
+
+# Parsed settings by path, with the modification time of the file
+_cache = {}
+
+
+def load(path=DEFAULT_PATH):
+    """Settings from path, only parsed again when the file has changed. Raises SettingsError."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError as e:
+        raise SettingsError("Can't read {0}: {1}".format(path, e))
+
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    settings = parse(path)
+    _cache[path] = (mtime, settings)
+    return settings
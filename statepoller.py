@@ -0,0 +1,467 @@
+"""
+Background polling of the OctoPrint REST API.
+
+The poller runs in its own thread and publishes an immutable PrinterState
+snapshot after every poll. The pygame loop only ever reads the latest
+snapshot, so a slow or unreachable OctoPrint never blocks drawing or input.
+
+Other sources, like the push API client in octoprintpush, publish their
+updates through the same poller so there is only one state model.
+
+The dashboard polls many printers; their pollers don't get a thread each
+but are run by a PollPool with a fixed number of workers.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import threading
+import time
+from collections import namedtuple
+
+import requests
+
+
+PrinterState = namedtuple('PrinterState', [
+    'seq',                  # Increases by one for every published snapshot
+    'timestamp',            # time.time() when the snapshot was taken
+    'hotend_temp',
+    'bed_temp',
+    'hotend_temp_target',
+    'bed_temp_target',
+    'heaters',              # (name, actual, target) for every heater, e.g. tool0, tool1, bed, chamber
+    'HotHotEnd',
+    'HotBed',
+    'Paused',
+    'Printing',
+    'JobLoaded',
+    'Completion',           # In procent
+    'PrintTimeLeft',
+    'FileName',
+])
+
+EMPTY_STATE = PrinterState(
+    seq=0,
+    timestamp=0.0,
+    hotend_temp=0.0,
+    bed_temp=0.0,
+    hotend_temp_target=0.0,
+    bed_temp_target=0.0,
+    heaters=(),
+    HotHotEnd=False,
+    HotBed=False,
+    Paused=False,
+    Printing=False,
+    JobLoaded=False,
+    Completion=0,
+    PrintTimeLeft=0,
+    FileName="Nothing",
+)
+
+
+class PollScheduler(object):
+    """
+    Decides how long to wait before the next poll. Polls every
+    `active_interval` ms while printing or while a heater is ramping towards
+    its target. When idle, or when the printer isn't connected to OctoPrint,
+    the interval starts at `idle_interval` and doubles up to
+    `max_idle_interval`. Failed polls back off the same way from
+    `active_interval` up to `max_error_interval`. While the screen is off
+    nobody is watching, so nothing is polled more often than every
+    `max_idle_interval` ms.
+    """
+
+    # A heater within this many degrees of its target is not ramping
+    temp_tolerance = 3.0
+
+    def __init__(self, active_interval, idle_interval=None, max_idle_interval=None, max_error_interval=None):
+        self.screen_off = False
+        self.configure(active_interval, idle_interval, max_idle_interval, max_error_interval)
+
+    def configure(self, active_interval, idle_interval=None, max_idle_interval=None, max_error_interval=None):
+        """Set the intervals, e.g. after the settings were reloaded."""
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval or active_interval
+        self.max_idle_interval = max(self.idle_interval, max_idle_interval or self.idle_interval)
+        self.max_error_interval = max(active_interval, max_error_interval or active_interval)
+        self.reset()
+
+    def reset(self):
+        """Start over at the fastest rate, e.g. after the user did something."""
+        self._idle_polls = 0
+        self._failed_polls = 0
+
+    def is_active(self, state, printer_state):
+        if printer_state in ("Printing", "Paused") or state.Printing or state.Paused:
+            return True
+        for name, actual, target in state.heaters:
+            if target > 0.0 and actual is not None and abs(target - actual) > self.temp_tolerance:
+                return True
+        return False
+
+    def next_interval(self, state, printer_state, ok):
+        """ms until the next poll, given the state after a poll and whether it succeeded."""
+        interval = self._next_interval(state, printer_state, ok)
+        if self.screen_off:
+            return max(interval, self.max_idle_interval)
+        return interval
+
+    def _next_interval(self, state, printer_state, ok):
+        if not ok:
+            self._failed_polls += 1
+            return min(self.active_interval * 2 ** (self._failed_polls - 1), self.max_error_interval)
+        # Only a poll that got this far has succeeded, is_active() raises on a state it doesn't understand
+        active = printer_state is not None and self.is_active(state, printer_state)
+        self._failed_polls = 0
+
+        if active:
+            self._idle_polls = 0
+            return self.active_interval
+
+        self._idle_polls += 1
+        return min(self.idle_interval * 2 ** (self._idle_polls - 1), self.max_idle_interval)
+
+
+class StatePoller(threading.Thread):
+    """
+    Fetches temperatures and printer state as often as the PollScheduler
+    says, every `interval` ms unless configured otherwise. Job and
+    connection info rarely change, they are fetched every `slow_interval` ms,
+    right after the printer state has changed, and on every poll while
+    printing to keep the progress up to date.
+    """
+
+    def __init__(self, api, apiurl_status, apiurl_job, apiurl_connection, interval, on_update=None, slow_interval=10000, scheduler=None):
+        threading.Thread.__init__(self, name="StatePoller")
+        self.daemon = True
+
+        self.api = api
+        self.apiurl_status = apiurl_status
+        self.apiurl_job = apiurl_job
+        self.apiurl_connection = apiurl_connection
+        self.interval = interval
+        self.on_update = on_update  # Called from the poller thread after each new snapshot
+        self.slow_interval = slow_interval
+        self.scheduler = scheduler or PollScheduler(interval)
+        self.failed_polls = 0
+
+        # Printer state text ("Operational", "Printing" etc) and when job info was last fetched
+        self._printer_state = None
+        # The state as /api/printer tells it, None while the printer isn't connected to OctoPrint.
+        #  Transitions are found by comparing this, the connection's state text differs from None.
+        self._status_state = None
+        self._job_fetched = 0.0
+
+        self._lock = threading.Lock()
+        self._state = EMPTY_STATE
+        self._active = threading.Event()
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+
+        # True while state is pushed to us, REST polling is then skipped
+        self.push_active = False
+
+        # A StateRecorder that every published snapshot is written to
+        self.recorder = None
+
+        # (connect, read) timeout in seconds of the very first poll, None for the API's own
+        self.first_timeout = None
+
+    def configure(self, apiurl_status, apiurl_job, apiurl_connection, interval, slow_interval):
+        """Change URLs and intervals, e.g. after the settings were reloaded. Takes effect on the next poll."""
+        self.apiurl_status = apiurl_status
+        self.apiurl_job = apiurl_job
+        self.apiurl_connection = apiurl_connection
+        self.interval = interval
+        self.slow_interval = slow_interval
+
+    @property
+    def state(self):
+        """The latest published PrinterState, never blocks on the network."""
+        with self._lock:
+            return self._state
+
+    def resume(self):
+        """Start polling, the first poll is made right away."""
+        self._active.set()
+
+    def pause(self):
+        """Stop polling until resume() is called."""
+        self._active.clear()
+
+    def poke(self):
+        """Poll right away and at the fastest rate again, call after sending a command."""
+        self.scheduler.reset()
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._active.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            # Sleep until connected
+            self._active.wait()
+            if self._stopped.is_set():
+                break
+
+            started = time.time()
+            if self.push_active:
+                interval = self.interval
+            else:
+                interval = self.step()
+
+            # Keep a steady rate regardless of how long the poll took
+            elapsed = time.time() - started
+            self._wake.wait(max(0.0, interval / 1000.0 - elapsed))
+            self._wake.clear()
+
+    def step(self):
+        """Poll once and return the ms until the next poll, for pollers run by a PollPool instead of their own thread."""
+        ok = self.poll()
+        return self.scheduler.next_interval(self.state, self._printer_state, ok)
+
+    def poll(self):
+        """Make one round of requests and publish the result. Returns False if OctoPrint couldn't be reached or gave an unusable answer."""
+        try:
+            values = self._fetch({})
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            return self._failed("Connection Error: {0}".format(e))
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError, AttributeError) as e:
+            # Something else answered, like a proxy's error or login page, or OctoPrint sent what we don't understand
+            return self._failed("Unexpected response: {0!r}".format(e))
+
+        if self.failed_polls:
+            print "Connection restored after {0} failed polls".format(self.failed_polls)
+            self.failed_polls = 0
+
+        self.publish(values)
+        return True
+
+    def _failed(self, message):
+        # Only report the first of a series of failures
+        self.failed_polls += 1
+        if self.failed_polls == 1:
+            print message
+        return False
+
+    def publish(self, changes, timestamp=None):
+        """
+        Publish a new snapshot with the given fields changed, read at the
+        time.time() timestamp, now if not given. Thread safe.
+        """
+        with self._lock:
+            values = self._state._asdict()
+            values.update(changes)
+            values['seq'] = self._state.seq + 1
+            values['timestamp'] = time.time() if timestamp is None else timestamp
+            self._state = PrinterState(**values)
+            if self.recorder is not None:
+                self.recorder.record(changes)
+
+        if self.on_update is not None:
+            self.on_update()
+
+    def _fetch(self, values):
+        if self.first_timeout is not None and self.failed_polls == 0 and self._state.seq == 0:
+            status, state, changed = self.api.get_json(self.apiurl_status, timeout=self.first_timeout)
+        else:
+            status, state, changed = self.api.get_json(self.apiurl_status)
+
+        status_state = self._status_state
+        if status == 200:
+            # Set status flags, unless it's all the same as last time
+            if changed:
+                temp_key = 'temps' if 'temps' in state else 'temperature'
+                parse_temperatures(state[temp_key], values)
+            if 'state' in state:
+                status_state = state['state']['text']
+        elif status == 409:
+            # The printer isn't connected to OctoPrint
+            status_state = None
+        elif status == 401:
+            print "Error: Unauthorized, check the apikey"
+
+        # Get info about current job when it may have changed
+        now = time.time()
+        transition = status_state != self._status_state
+        slow_due = now - self._job_fetched >= self.slow_interval / 1000.0
+        if not (transition or slow_due or status_state == "Printing"):
+            return values
+
+        status, job_state, job_changed = self.api.get_json(self.apiurl_job)
+        if status != 200:
+            return values
+
+        printer_state = status_state
+        if transition or slow_due or printer_state is None:
+            status, conn_state, conn_changed = self.api.get_json(self.apiurl_connection)
+            if status != 200:
+                return values
+            printer_state = conn_state['current']['state']
+
+        self._status_state = status_state
+        self._printer_state = printer_state
+        self._job_fetched = now
+        parse_job(job_state, printer_state, values)
+
+        return values
+
+
+def parse_temperatures(temps, values):
+    """
+    Set the temperature fields of values from an OctoPrint {heater: {actual, target}} dict.
+    Printers without a heated bed have no bed, its fields are then 0.0.
+    """
+    values['heaters'] = tuple(sorted(
+        (name, temp['actual'], temp.get('target') or 0.0)
+        for name, temp in temps.items()
+        if isinstance(temp, dict) and 'actual' in temp))
+
+    heaters = dict((name, (actual, target)) for name, actual, target in values['heaters'])
+    hotend_temp, values['hotend_temp_target'] = heaters.get('tool0', (0.0, 0.0))
+    bed_temp, values['bed_temp_target'] = heaters.get('bed', (0.0, 0.0))
+    values['hotend_temp'] = hotend_temp or 0.0
+    values['bed_temp'] = bed_temp or 0.0
+
+    values['HotHotEnd'] = values['hotend_temp_target'] > 0.0
+    values['HotBed'] = values['bed_temp_target'] > 0.0
+
+
+def parse_job(job_state, printer_state, values):
+    """Set the job fields of values from an OctoPrint job dict and printer state text."""
+    values['Completion'] = job_state['progress']['completion']  # In procent
+    values['PrintTimeLeft'] = job_state['progress']['printTimeLeft']
+    values['FileName'] = job_state['job']['file']['name']
+    values['JobLoaded'] = printer_state == "Operational" and (job_state['job']['file']['name'] != "") or (job_state['job']['file']['name'] is not None)
+
+    values['Paused'] = printer_state == "Paused"
+    values['Printing'] = printer_state == "Printing"
+
+
+class PollPool(object):
+    """
+    Runs many StatePollers, such as one per printer on the dashboard, from a
+    fixed number of worker threads. Each poller keeps its own PollScheduler,
+    so every printer backs off on its own, and a worker takes whichever poll
+    is due first. A poll to a printer that doesn't answer can take the whole
+    connect or read timeout, so printers whose last poll failed may only
+    occupy all workers but one: the printers that do answer always have a
+    worker left and are never held up by the ones that are down. Until a
+    printer has been polled nobody knows if it's down, so its first poll
+    gets a short first_timeout instead. At worst that poll fails and the
+    next one waits as long as usual.
+    """
+
+    # Keep a worker free for the printers that answer, only turned off to compare in benchmarks
+    reserve_worker = True
+
+    # (connect, read) timeout in seconds of every printer's first poll
+    first_timeout = (1.0, 1.0)
+
+    def __init__(self, pollers, workers=4, on_poll=None):
+        """Create a new pool. Parameters:
+            pollers - StatePollers that aren't started, they are polled with step()
+            workers - Number of threads making polls
+            on_poll - Called from a worker thread after every poll, whether it succeeded or not
+            """
+        self.pollers = list(pollers)
+        for poller in self.pollers:
+            poller.first_timeout = self.first_timeout
+        self.workers = max(1, workers)
+        self.on_poll = on_poll
+        self.polls = 0
+
+        # time.time() of the next poll per poller, None while it's being polled
+        self._due = dict((poller, 0.0) for poller in self.pollers)
+        # Workers busy with a printer that may not answer
+        self._suspect = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name="PollPool-{0}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def poke(self, poller):
+        """Poll right away and at the fastest rate again."""
+        with self._cond:
+            poller.scheduler.reset()
+            if self._due[poller] is not None:
+                self._due[poller] = 0.0
+                self._cond.notify()
+
+    def _take(self):
+        """
+        The poller to poll now, or None and the seconds until one is due (None
+        to wait until a poll is done). Called with the lock held.
+        """
+        reserve = self.reserve_worker and self.workers > 1 and self._suspect >= self.workers - 1
+        first = None
+        for poller in self.pollers:
+            due = self._due[poller]
+            if due is None or (reserve and self._is_suspect(poller)):
+                continue
+            if first is None or due < self._due[first]:
+                first = poller
+        if first is None:
+            return None, None
+
+        wait = self._due[first] - time.time()
+        if wait > 0:
+            return None, wait
+        return first, 0
+
+    def _is_suspect(self, poller):
+        # Only a failed poll makes a printer suspect, one that hasn't been polled yet may well answer
+        return poller.failed_polls > 0
+
+    def _work(self):
+        while True:
+            with self._cond:
+                poller = None
+                while not self._stopped:
+                    poller, wait = self._take()
+                    if poller is not None:
+                        break
+                    self._cond.wait(wait)
+                if self._stopped:
+                    return
+                self._due[poller] = None
+                suspect = self._is_suspect(poller)
+                if suspect:
+                    self._suspect += 1
+
+            started = time.time()
+            interval = poller.scheduler.max_error_interval
+            try:
+                interval = poller.step()
+            except Exception as e:
+                # Whatever went wrong, the printer backs off like one that doesn't answer and the
+                #  worker carries on. A worker that dies would leave the other printers waiting.
+                poller._failed("Poll failed: {0!r}".format(e))
+                interval = poller.scheduler.next_interval(poller.state, None, False)
+            finally:
+                with self._cond:
+                    if suspect:
+                        self._suspect -= 1
+                    self._due[poller] = started + interval / 1000.0
+                    self.polls += 1
+                    self._cond.notify_all()
+
+            if self.on_poll is not None:
+                self.on_poll()
@@ -0,0 +1,170 @@
+"""
+Recording and replay of printer state.
+
+StateRecorder appends every snapshot published by the StatePoller to a
+file, so a whole print can be played back later by StateReplayer without
+OctoPrint, faster than real time if wanted.
+
+The file has one JSON array per line. A session starts with
+["session", start time] and every snapshot after that is
+[seconds since the session started, {fields that changed}], the dict left
+out when nothing changed. New sessions are appended to the same file.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import json
+import threading
+import time
+
+_MISSING = object()
+
+
+def _round(value):
+    # OctoPrint reports temperatures with two decimals, more only takes up space
+    if isinstance(value, float):
+        return round(value, 2)
+    if isinstance(value, tuple):
+        return tuple(_round(v) for v in value)
+    return value
+
+
+def _compact(line):
+    return json.dumps(line, separators=(',', ':')) + '\n'
+
+
+class StateRecorder(object):
+    def __init__(self, path):
+        """Append snapshots to the file at path, starting a new session."""
+        self.path = path
+        self.started = time.time()
+        self.snapshots = 0
+        self._last = {}
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+        self._write(["session", round(self.started, 3)])
+
+    def record(self, changes):
+        """Record a published snapshot, changes are the fields set by the parse functions."""
+        with self._lock:
+            if self._file is None:
+                return
+            diff = {}
+            for name, value in changes.iteritems():
+                value = _round(value)
+                if self._last.get(name, _MISSING) != value:
+                    diff[name] = value
+                    self._last[name] = value
+
+            line = [round(time.time() - self.started, 3)]
+            if diff:
+                line.append(diff)
+            self._write(line)
+            self.snapshots += 1
+
+    def _write(self, line):
+        # Flushed right away, so a crash or power cut keeps what was recorded
+        self._file.write(_compact(line))
+        self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_sessions(path):
+    """
+    Yield (session start, seconds since start, changes) for every snapshot in
+    a recording, with the changes relative to the snapshot before it.
+    """
+    session = None
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry[0] == "session":
+                session = entry[1]
+                continue
+
+            changes = entry[1] if len(entry) > 1 else {}
+            if 'heaters' in changes:
+                # JSON has no tuples, the state model keeps heaters as tuples
+                changes['heaters'] = tuple(tuple(heater) for heater in changes['heaters'])
+            yield session, entry[0], changes
+
+
+class StateReplayer(threading.Thread):
+    """
+    Publishes the snapshots of a recording to a StatePoller at `speed` times
+    the recorded pace. Every snapshot is shown: when the panel can't keep up,
+    the replay waits for it instead of skipping snapshots, so a replay gives
+    the same frames every time.
+    """
+
+    def __init__(self, path, poller, speed=1.0, on_done=None):
+        """Create a new replayer. Parameters:
+            path - The recording to play
+            poller - The StatePoller to publish the snapshots to
+            speed - How many times faster than recorded to play
+            on_done - Called from the replay thread when the recording has ended
+            """
+        threading.Thread.__init__(self, name="StateReplayer")
+        self.daemon = True
+
+        self.path = path
+        self.poller = poller
+        self.speed = speed
+        self.on_done = on_done
+        self.snapshots = 0
+        self._seq = None
+        self._acked = threading.Condition()
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+        with self._acked:
+            self._acked.notify()
+
+    def ack(self, seq):
+        """The panel has picked up the snapshot with this seq, call from the pygame loop."""
+        with self._acked:
+            if self._seq is not None and seq >= self._seq:
+                self._seq = None
+                self._acked.notify()
+
+    def run(self):
+        started = time.time()
+        offset = 0.0 # Recorded seconds before the current session
+        last_session = None
+        last_t = 0.0
+
+        for session, t, changes in read_sessions(self.path):
+            if session != last_session:
+                # Sessions are played back to back
+                offset += last_t
+                last_session = session
+            last_t = t
+
+            # Absolute schedule, so waiting for the panel doesn't add up to drift
+            delay = started + (offset + t) / self.speed - time.time()
+            if delay > 0:
+                self._stopped.wait(delay)
+            if self._stopped.is_set():
+                return
+
+            with self._acked:
+                # Stamped with when it was recorded, so the graph buckets a replay like the print
+                recorded = (offset if session is None else session) + t
+                self.poller.publish(changes, recorded)
+                self._seq = self.poller.state.seq
+                while self._seq is not None and not self._stopped.is_set():
+                    self._acked.wait(1.0)
+            self.snapshots += 1
+
+        if self.on_done is not None and not self._stopped.is_set():
+            self.on_done()
@@ -0,0 +1,659 @@
+"""
+Temperature graph for OctoPiPanel.
+
+The chart chrome (white area, axes, scale labels and grid lines) only
+changes when the temperature scale does, so it is rendered into an offscreen
+surface and blitted before the temperature series are drawn on top.
+
+The series themselves are kept on a second, transparent surface. When a new
+sample arrives that surface is scrolled one pixel to the left and only the
+newest column is drawn, so the cost of a frame doesn't depend on how much
+history is shown. A full replot (on creation, resize or a new scale) is done
+in one go with NumPy and pygame.surfarray when NumPy is installed. NumPy is
+slow to import on a Pi, so that only happens once there is history to plot.
+
+Every heater reported by OctoPrint gets its own series. The scale follows
+the lowest and highest temperature in the shown history, which are kept
+up to date per sample instead of rescanning the history.
+
+Besides one sample per pixel, every series keeps min/max/mean buckets of
+the last hour and of the whole job (Tier), a few KB each however long the
+print. Zooming out to those plots the buckets, never the raw samples.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import math
+import time
+from array import array
+from collections import deque
+
+import pygame
+
+# Set by load_numpy()
+numpy = None
+_numpy_tried = False
+
+
+def load_numpy():
+    """Import NumPy on first use, returns the module or None if it isn't installed."""
+    global numpy, _numpy_tried
+    if not _numpy_tried:
+        _numpy_tried = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+
+NAN = float('nan')
+
+# Series and target line colors for known heaters
+HEATER_COLORS = {
+    'tool0': ((220, 0, 0), (180, 40, 40)),
+    'tool1': ((0, 150, 0), (40, 130, 40)),
+    'tool2': ((230, 130, 0), (190, 120, 40)),
+    'tool3': ((0, 160, 160), (40, 140, 140)),
+    'bed': ((0, 0, 220), (40, 40, 180)),
+    'chamber': ((150, 0, 150), (130, 40, 130)),
+}
+OTHER_COLORS = ((100, 100, 100), (130, 130, 130))
+
+# What the graph can show, tapping it goes to the next one. The first is one
+# sample per pixel, its name follows from the time the samples cover.
+ZOOM_LEVELS = (None, '1 h', 'Job')
+
+# Buckets kept per tier, and the seconds per bucket of the last hour
+TIER_SIZE = 240
+HOUR_BUCKET = 3600.0 / TIER_SIZE
+
+
+def heater_order(name):
+    """Sort key for heaters, series drawn later end up on top."""
+    if name.startswith('tool'):
+        return (0, name)
+    if name == 'bed':
+        return (1, name)
+    return (2, name)
+
+
+class RingBuffer(object):
+    """Fixed size history of floats, oldest value first when iterated."""
+
+    def __init__(self, size, value=0.0):
+        self._data = array('d', [value] * size)
+        self._head = 0 # index of the oldest value
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        data = self._data
+        head = self._head
+        for i in xrange(head, len(data)):
+            yield data[i]
+        for i in xrange(0, head):
+            yield data[i]
+
+    def __getitem__(self, index):
+        """Value by age, 0 is the oldest and -1 the newest."""
+        if index < 0:
+            index += len(self._data)
+        if not 0 <= index < len(self._data):
+            raise IndexError("RingBuffer index out of range")
+        return self._data[(self._head + index) % len(self._data)]
+
+    def ordered(self):
+        """All values as an array, oldest first."""
+        return self._data[self._head:] + self._data[:self._head]
+
+    def append(self, value):
+        """Add a value, dropping the oldest one."""
+        self._data[self._head] = value
+        self._head = (self._head + 1) % len(self._data)
+
+
+class MinMaxWindow(object):
+    """
+    Lowest and highest of the last `size` values. Each push is O(1) amortized,
+    using monotonic queues of (index, value) pairs. NaN values are ignored.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._count = 0
+        self._lows = deque()  # values increasing, the front is the minimum
+        self._highs = deque() # values decreasing, the front is the maximum
+
+    def push(self, value):
+        index = self._count
+        self._count += 1
+
+        if value == value:
+            while self._lows and self._lows[-1][1] >= value:
+                self._lows.pop()
+            self._lows.append((index, value))
+            while self._highs and self._highs[-1][1] <= value:
+                self._highs.pop()
+            self._highs.append((index, value))
+
+        # Forget values that have left the window
+        oldest = self._count - self.size
+        while self._lows and self._lows[0][0] < oldest:
+            self._lows.popleft()
+        while self._highs and self._highs[0][0] < oldest:
+            self._highs.popleft()
+
+    @property
+    def min(self):
+        return self._lows[0][1] if self._lows else None
+
+    @property
+    def max(self):
+        return self._highs[0][1] if self._highs else None
+
+
+class Tier(object):
+    """
+    Lowest, highest and mean temperature per `duration` seconds, for the last
+    `size` periods. A growing tier drops nothing: when it's full, neighbouring
+    buckets are merged and the duration doubles, so it covers everything
+    since reset() in at most `size` buckets.
+    """
+
+    def __init__(self, duration, size, grow=False):
+        self.initial_duration = duration
+        self.size = size
+        self.grow = grow
+        self.reset()
+
+    def reset(self):
+        self.duration = self.initial_duration
+        self.first = None # Bucket number, time / duration, of the oldest bucket
+        self.mins = array('f')
+        self.maxs = array('f')
+        self.means = array('f')
+        self.counts = array('I')
+
+    def __len__(self):
+        return len(self.counts)
+
+    def align(self, other):
+        """
+        Use the bucket duration and first bucket of other, so a bucket
+        number stands for the same stretch of time in both. Call while empty.
+        """
+        self.duration = other.duration
+        self.first = other.first
+
+    @property
+    def last(self):
+        """Bucket number of the newest bucket, None while empty."""
+        return None if self.first is None else self.first + len(self.counts) - 1
+
+    def add(self, t, value):
+        """Add a sample taken at time t, NaN only moves time forward."""
+        number = int(t // self.duration)
+        if self.first is None:
+            self.first = number
+        if self.grow:
+            while number - self.first >= self.size:
+                self._merge()
+                number = int(t // self.duration)
+        elif number - self.last >= self.size:
+            # Nothing left that is recent enough
+            self.reset()
+            self.first = number
+
+        # Empty buckets for the time without samples, up to this sample's
+        last = self.last
+        while last < number:
+            self._append()
+            last += 1
+        if len(self.counts) > self.size:
+            drop = len(self.counts) - self.size
+            for values in (self.mins, self.maxs, self.means, self.counts):
+                del values[:drop]
+            self.first += drop
+
+        if value == value:
+            # Samples from before the newest bucket (the clock went back) go into it
+            i = len(self.counts) - 1
+            count = self.counts[i] + 1
+            self.counts[i] = count
+            if count == 1:
+                self.mins[i] = self.maxs[i] = self.means[i] = value
+            else:
+                self.mins[i] = min(self.mins[i], value)
+                self.maxs[i] = max(self.maxs[i], value)
+                self.means[i] += (value - self.means[i]) / count
+
+    def _append(self):
+        self.mins.append(NAN)
+        self.maxs.append(NAN)
+        self.means.append(NAN)
+        self.counts.append(0)
+
+    def _merge(self):
+        """Halve the resolution, bucket n becomes part of bucket n / 2."""
+        mins, maxs, means, counts = self.mins, self.maxs, self.means, self.counts
+        first = self.first
+        self.duration *= 2
+        self.first = first / 2
+        self.mins, self.maxs, self.means, self.counts = array('f'), array('f'), array('f'), array('I')
+        for i in xrange(len(counts)):
+            j = (first + i) / 2 - self.first
+            if j == len(self.counts):
+                self._append()
+            count = counts[i]
+            if not count:
+                continue
+            merged = self.counts[j] + count
+            if self.counts[j]:
+                self.mins[j] = min(self.mins[j], mins[i])
+                self.maxs[j] = max(self.maxs[j], maxs[i])
+                self.means[j] += (means[i] - self.means[j]) * count / merged
+            else:
+                self.mins[j], self.maxs[j], self.means[j] = mins[i], maxs[i], means[i]
+            self.counts[j] = merged
+
+    def buckets(self, start=None):
+        """(bucket number, min, max, mean) of the buckets with samples, oldest first, from bucket number start on."""
+        if self.first is None:
+            return []
+        first = self.first
+        begin = 0 if start is None else max(0, start - first)
+        return [(first + i, self.mins[i], self.maxs[i], self.means[i]) for i in xrange(begin, len(self.counts)) if self.counts[i]]
+
+    def extremes(self):
+        """(lowest, highest) temperature in the tier, None if it has no samples."""
+        lows = [low for low, count in zip(self.mins, self.counts) if count]
+        if not lows:
+            return None
+        return min(lows), max(high for high, count in zip(self.maxs, self.counts) if count)
+
+
+class Series(object):
+    """Temperature history of one heater."""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.color, self.color_target = HEATER_COLORS.get(name, OTHER_COLORS)
+        self.target = 0.0
+        self.hour = Tier(HOUR_BUCKET, TIER_SIZE)
+        self.job = Tier(HOUR_BUCKET, TIER_SIZE, grow=True)
+        self.resize(size)
+
+    def tier(self, zoom):
+        """The Tier plotted at a zoom level other than the first."""
+        return self.hour if zoom == 1 else self.job
+
+    def resize(self, size):
+        """Change the number of samples kept, the newest ones are kept."""
+        old = list(getattr(self, 'temps', []))[-size:]
+        self.temps = RingBuffer(size, NAN)
+        self.extremes = MinMaxWindow(size)
+        for t in old:
+            self.append(t)
+
+    def append(self, temp, t=None):
+        self.temps.append(temp)
+        self.extremes.push(temp)
+        if t is not None:
+            self.hour.add(t, temp)
+            self.job.add(t, temp)
+
+
+class TempGraph(object):
+    # Room for the scale labels left of and above/below the graph area
+    label_width = 26
+    label_height = 6
+
+    # The scale is rounded to this many degrees and covers at least that much
+    scale_step = 50
+
+    # Transparent color of the series surface
+    color_key = (255, 0, 255)
+
+    # Taps on the graph change the zoom level, see OctoPiPanel._layout()
+    visible = True
+
+    def __init__(self, left, top, width, height, font, color_bg):
+        """Create a new graph. Parameters:
+            left, top, width, height - The plotting area in screen coordinates
+            font - The pygame.font.Font used for the scale labels
+            color_bg - Color behind the scale labels, it is left transparent
+            """
+        self.font = font
+        self.color_bg = color_bg
+        self.series = {}
+        self.series_order = []
+        self.zoom = 0 # Index in ZOOM_LEVELS
+
+        # Temperature at the bottom and top of the graph
+        self.min_temp = 0
+        self.max_temp = 250
+
+        self.resize(left, top, width, height)
+
+    def resize(self, left, top, width, height):
+        """Move or resize the graph, re-renders the static background and the series."""
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+
+        # Everything the graph draws on, including scale labels and target lines
+        self.rect = pygame.Rect(left - self.label_width, top - self.label_height, width + self.label_width + 4, height + self.label_height * 2)
+
+        # One sample per pixel, history that still fits is kept on a resize
+        for series in self.series.values():
+            series.resize(width)
+        old = list(getattr(self, 'times', []))[-width:]
+        self.times = RingBuffer(width, NAN) # time.time() of every sample, shared by all series
+        for t in old:
+            self.times.append(t)
+        self.samples = min(getattr(self, 'samples', 0), len(old))
+
+        # The series surface is one pixel wider than the graph since every sample is drawn two pixels wide
+        self.plot = pygame.Surface((width + 1, self.rect.height)).convert()
+        self.plot.set_colorkey(self.color_key)
+        self._rescale()
+
+    @property
+    def zoom_name(self):
+        if self.zoom == 0:
+            return self._live_name()
+        return ZOOM_LEVELS[self.zoom]
+
+    def _live_name(self):
+        """How much time a full graph of samples covers, at the pace samples have come in so far."""
+        count = min(self.samples, self.width)
+        if count < 2:
+            return "Live"
+        seconds = (self.times[-1] - self.times[-count]) / (count - 1) * self.width
+        if seconds <= 0:
+            return "Live"
+        minutes = int(round(seconds / 60.0))
+        if minutes >= 120:
+            return "{0} h".format(int(round(minutes / 60.0)))
+        return "{0} min".format(max(1, minutes))
+
+    def set_zoom(self, zoom):
+        """Show another zoom level, an index in ZOOM_LEVELS. Wraps around."""
+        self.zoom = zoom % len(ZOOM_LEVELS)
+        self.min_temp, self.max_temp = self._scale()
+        self._rescale()
+
+    def start_job(self):
+        """A print has started, the Job zoom level starts over."""
+        for series in self.series.values():
+            series.job.reset()
+        if self.zoom == 2:
+            self._render_series()
+
+    def _rescale(self):
+        """Re-render everything after a change of size, scale or zoom level."""
+        self.background = self._render_background()
+        self._render_series()
+
+    def _render_background(self):
+        surf = pygame.Surface(self.rect.size).convert()
+        surf.fill(self.color_bg)
+
+        # Graph area, in coordinates local to the background surface
+        left = self.label_width
+        top = self.label_height
+        width = self.width
+        height = self.height
+        pygame.draw.rect(surf, (255, 255, 255), (left, top, width, height))
+
+        # Graph axes
+        # X, temp
+        pygame.draw.line(surf, (0, 0, 0), [left, top], [left, top + height], 2)
+
+        # X-axis divisions, scale and grey lines at every fifth of the scale
+        scale_gap = (self.max_temp - self.min_temp) / 5
+        for i in range(6):
+            y = top + (height / 5) * (5 - i)
+            pygame.draw.line(surf, (0, 0, 0), [left - 3, y], [left, y], 2)
+
+            lbl = self.font.render(str(self.min_temp + i * scale_gap), 1, (200, 200, 200))
+            surf.blit(lbl, (left - 26, y - 6))
+
+            if 0 < i < 5:
+                pygame.draw.line(surf, (200, 200, 200), [left + 2, y], [left + width - 2, y], 1)
+
+        # Y, time
+        pygame.draw.line(surf, (0, 0, 0), [left, top + height], [left + width, top + height], 2)
+
+        # What's shown, in the top right corner
+        self.shown_name = self.zoom_name
+        lbl = self.font.render(self.shown_name, 1, (150, 150, 150))
+        surf.blit(lbl, (left + width - lbl.get_width() - 3, top + 2))
+
+        # Let whatever is below show through around the graph area
+        surf.set_colorkey(self.color_bg, pygame.RLEACCEL)
+        return surf
+
+    def _scale(self):
+        """(min_temp, max_temp) covering the shown history and the targets, rounded to scale_step."""
+        lows = []
+        highs = []
+        for series in self.series.values():
+            if self.zoom:
+                extremes = series.tier(self.zoom).extremes()
+            elif series.extremes.min is not None:
+                extremes = (series.extremes.min, series.extremes.max)
+            else:
+                extremes = None
+            if extremes is not None:
+                lows.append(extremes[0])
+                highs.append(extremes[1])
+            highs.append(series.target)
+
+        if not highs:
+            return self.min_temp, self.max_temp
+
+        step = self.scale_step
+        min_temp = min(0, int(math.floor(min(lows) / step)) * step) if lows else 0
+        max_temp = max(min_temp + step, int(math.ceil(max(highs) / step)) * step)
+        return min_temp, max_temp
+
+    def add_sample(self, heaters, timestamp=None):
+        """
+        Add the latest temperatures, scrolling the graph one pixel.
+        heaters is a sequence of (name, actual, target) for every heater,
+        timestamp the time.time() they were read at, now if not given.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        tiers = self._tier_key()
+        self.times.append(timestamp)
+        self.samples += 1
+
+        new_series = False
+        seen = set()
+        for name, actual, target in heaters:
+            series = self.series.get(name)
+            if series is None:
+                series = Series(name, self.width)
+                if self.series_order:
+                    # A heater first reported during a job, its buckets have to line up with the others'
+                    series.job.align(self.series[self.series_order[0]].job)
+                self.series[name] = series
+                new_series = True
+            series.append(NAN if actual is None else actual, timestamp)
+            series.target = target or 0.0
+            seen.add(name)
+
+        # Heaters that weren't reported have a gap in their history
+        for name, series in self.series.items():
+            if name not in seen:
+                series.append(NAN, timestamp)
+
+        if new_series:
+            self.series_order = sorted(self.series.keys(), key=heater_order)
+
+        scale = self._scale()
+        if new_series or scale != (self.min_temp, self.max_temp):
+            self.min_temp, self.max_temp = scale
+            self._rescale()
+            return
+
+        # The time a full graph covers follows the polling pace
+        if self.zoom_name != self.shown_name:
+            self.background = self._render_background()
+
+        if self.zoom:
+            # Zoomed out, the buckets only move when a new one is started
+            if self._tier_key() != tiers:
+                self._render_series()
+            else:
+                self._replot_bucket(self._shown_tier().last)
+            return
+
+        # Scroll what's already plotted one pixel to the left
+        width = self.width
+        height = self.rect.height
+        self.plot.scroll(-1, 0)
+
+        # The two rightmost columns hold the previous sample's right half and the new sample
+        self._replot((width - 1, 0, 2, height), ((-2, width - 2), (-1, width - 1)))
+        # The leftmost column still holds the right half of the sample that was dropped
+        self._replot((0, 0, 1, height), ((0, 0),))
+
+    def _ordered_series(self):
+        return [self.series[name] for name in self.series_order]
+
+    def _replot(self, area, samples):
+        """Clear area of the series surface and plot (index, x) samples of all series inside it."""
+        self.plot.set_clip(area)
+        self.plot.fill(self.color_key)
+        for series in self._ordered_series():
+            for index, x in samples:
+                self._plot(series.temps[index], x, series.color)
+        self.plot.set_clip(None)
+
+    def _shown_tier(self):
+        """The Tier of the first series at the current zoom level, heaters are reported together so the others match it."""
+        return self.series[self.series_order[0]].tier(self.zoom)
+
+    def _tier_key(self):
+        # Changes when the buckets shown at the current zoom level move
+        if not self.zoom or not self.series:
+            return None
+        tier = self._shown_tier()
+        return (tier.first, len(tier), tier.duration)
+
+    def _bucket_columns(self, number):
+        """(x, width) of a bucket in the series surface at the current zoom level."""
+        tier = self._shown_tier()
+        # The last hour ends at the right edge, a job starts at the left one
+        oldest = tier.first if tier.grow else tier.last - tier.size + 1
+        left = (number - oldest) * self.width / tier.size
+        right = (number - oldest + 1) * self.width / tier.size
+        return left, max(2, right - left)
+
+    def _replot_bucket(self, number):
+        """Clear the columns of one bucket and plot it again for all series, after a sample was added to it."""
+        x, width = self._bucket_columns(number)
+        self.plot.fill(self.color_key, (x, 0, width, self.rect.height))
+        for series in self._ordered_series():
+            bucket = series.tier(self.zoom).buckets(number)
+            if bucket:
+                self._plot_bucket(bucket[0], series.color)
+
+    def _render_buckets(self):
+        for series in self._ordered_series():
+            for bucket in series.tier(self.zoom).buckets():
+                self._plot_bucket(bucket, series.color)
+
+    def _plot_bucket(self, bucket, color):
+        # The range of the bucket as a line, its mean as a 2x2 block like a sample
+        number, low, high, mean = bucket
+        x, width = self._bucket_columns(number)
+        x += width / 2
+        top = self.rect.top
+        pygame.draw.line(self.plot, color, [x, self._y(high) - top], [x, self._y(low) - top], 1)
+        self._plot(mean, x - 1, color)
+
+    def _render_series(self):
+        """Plot the whole history, only needed when the graph is created, resized, rescaled or zoomed."""
+        self.plot.fill(self.color_key)
+        if not self.series:
+            return
+
+        if self.zoom:
+            self._render_buckets()
+            return
+
+        if load_numpy() is not None:
+            try:
+                self._render_series_numpy()
+                return
+            except ValueError:
+                # pixels2d() can't reference 24 bit surfaces, plot sample by sample
+                self.plot.fill(self.color_key)
+
+        self._render_series_loop()
+
+    def _render_series_loop(self):
+        for series in self._ordered_series():
+            x = 0
+            for t in series.temps:
+                self._plot(t, x, series.color)
+                x += 1
+
+    def _render_series_numpy(self):
+        """Same pixels as _render_series_loop(), written straight to the surface."""
+        w, h = self.plot.get_size()
+        g_scale = self.height / float(self.max_temp - self.min_temp)
+        bottom = self.top + self.height - self.rect.top
+
+        pixels = pygame.surfarray.pixels2d(self.plot)
+        try:
+            for series in self._ordered_series():
+                temps = numpy.array(series.temps.ordered(), dtype=float)
+                known = ~numpy.isnan(temps)
+                xs = numpy.arange(len(temps))[known]
+                ys = bottom - ((temps[known] - self.min_temp) * g_scale).astype(int)
+                mapped = self.plot.map_rgb(series.color)
+
+                # Every sample is a 2x2 pixel block, see _plot()
+                for dx in (0, 1):
+                    for dy in (0, 1):
+                        x = xs + dx
+                        y = ys + dy
+                        inside = (x < w) & (y >= 0) & (y < h)
+                        pixels[x[inside], y[inside]] = mapped
+        finally:
+            # Unlock the surface
+            del pixels
+
+    def _y(self, temp):
+        """Screen y coordinate for a temperature."""
+        g_scale = self.height / float(self.max_temp - self.min_temp)
+        return self.top + self.height - int((temp - self.min_temp) * g_scale)
+
+    def _plot(self, temp, x, color):
+        # x is relative to the graph area, y to the series surface.
+        #  This draws a 2x2 pixel block with its top left corner at x, y.
+        if temp != temp:
+            return # No sample
+        y = self._y(temp) - self.rect.top
+        pygame.draw.line(self.plot, color, [x, y], [x + 1, y], 2)
+
+    def draw(self, surface):
+        """Draw the graph with the latest target temperatures onto surface."""
+        surface.blit(self.background, self.rect)
+        surface.blit(self.plot, (self.left, self.rect.top))
+
+        # Draw target temperatures
+        g_scale = self.height / float(self.max_temp - self.min_temp)
+        bottom = self.top + self.height
+        for series in self._ordered_series():
+            y = bottom - (series.target - self.min_temp) * g_scale
+            pygame.draw.line(surface, series.color_target, [self.left, y], [self.left + self.width, y], 1)
@@ -0,0 +1,54 @@
+"""
+Cache for rendered text surfaces.
+
+Font.render() is one of the more expensive calls on a Raspberry Pi, and most
+of the texts on the panel are either static or change at most once per poll.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+from collections import OrderedDict
+
+
+class TextCache(object):
+    def __init__(self, size=64):
+        """Create a new cache holding at most `size` rendered texts."""
+        self.size = size
+        self._surfaces = OrderedDict()
+
+        # Statistics, useful when tuning the cache size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def render(self, font, text, color, antialias=True):
+        """Same as font.render(text, antialias, color) but cached. Don't draw on the returned surface."""
+        key = (font, text, tuple(color), antialias)
+
+        surf = self._surfaces.pop(key, None)
+        if surf is None:
+            self.misses += 1
+            surf = font.render(text, antialias, color)
+            if len(self._surfaces) >= self.size:
+                self._surfaces.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+
+        # (Re)insert as most recently used
+        self._surfaces[key] = surf
+        return surf
+
+    def clear(self):
+        self._surfaces.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._surfaces),
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Stand-in for OctoPrint's push API that replays recorded push messages.
+
+Serves the SockJS websocket endpoint and /api/login, which is all the
+OctoPiPanel push client needs, so it can be tried without a printer.
+Recordings are JSON lines of {"delay": seconds, "message": {...}}, see
+push_frames.jsonl. Every connection replays the recording in a loop.
+
+Usage:
+    python tools/push_replay_server.py [recording] [port]
+
+and set baseurl = http://localhost:<port> and push_updates = true in
+OctoPiPanel.cfg.
+"""
+
+__author__ = "Jonas Lorander"
+__license__ = "Simplified BSD 2-Clause License"
+
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def load_recording(path):
+    frames = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                frames.append(json.loads(line))
+    return frames
+
+
+def encode_frame(text):
+    """A single unmasked websocket text frame, as sent by a server."""
+    data = text.encode('utf-8') if isinstance(text, unicode) else text
+    if len(data) < 126:
+        header = struct.pack('!BB', 0x81, len(data))
+    elif len(data) < 65536:
+        header = struct.pack('!BBH', 0x81, 126, len(data))
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, len(data))
+    return header + data
+
+
+def sockjs_message(message):
+    # SockJS array frame holding one JSON-encoded message, like sockjs-tornado sends
+    return 'a' + json.dumps([json.dumps(message)])
+
+
+class PushReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.split('?')[0] == '/api/login':
+            self._send_json({'name': '_api', 'session': 'replay'})
+        else:
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path.startswith('/sockjs/') and path.endswith('/websocket') and self.headers.get('Upgrade', '').lower() == 'websocket':
+            self._websocket()
+        else:
+            self._send_json({'error': 'Not found'}, 404)
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _websocket(self):
+        accept = base64.b64encode(hashlib.sha1(self.headers['Sec-WebSocket-Key'] + WEBSOCKET_GUID).digest())
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        # Client messages (auth, throttle) aren't needed, don't wait for them
+        self.connection.setblocking(1)
+        try:
+            self.connection.sendall(encode_frame('o'))
+            while True:
+                for frame in self.server.recording:
+                    time.sleep(frame.get('delay', 0) / self.server.speed)
+                    self.connection.sendall(encode_frame(sockjs_message(frame['message'])))
+        except socket.error:
+            # Client went away
+            pass
+        self.close_connection = 1
+
+
+class PushReplayServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, recording, speed=1.0):
+        HTTPServer.__init__(self, address, PushReplayHandler)
+        self.recording = recording
+        self.speed = speed
+
+
+def main():
+    directory = os.path.dirname(os.path.realpath(__file__))
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(directory, 'push_frames.jsonl')
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    server = PushReplayServer(('', port), load_recording(path))
+    print "Replaying {0} on port {1}".format(path, port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()